@@ -1,10 +1,12 @@
 from cmd.cmd import Cmd
 from cmd.conf_cmd import ConfCmd
 from cmd.count_cmd import CountCmd
+from cmd.daemon_cmd import DaemonCmd
 from cmd.desc_cmd import DescCmd
 from cmd.export_cmd import ExportCmd
 from cmd.help_cmd import HelpCmd
 from cmd.history_cmd import HistoryCmd
+from cmd.import_cmd import ImportCmd
 from cmd.info_cmd import InfoCmd
 from cmd.load_cmd import LoadCmd
 from cmd.peek_cmd import PeekCmd
@@ -14,6 +16,7 @@ from cmd.set_cmd import SetCmd
 from cmd.shell_cmd import ShellCmd
 from cmd.show_cmd import ShowCmd
 from cmd.sql_cmd import SqlCmd
+from cmd.stats_cmd import StatsCmd
 from cmd.test_cmd import TestCmd
 from cmd.unlock_cmd import UnlockCmd
 from cmd.version_cmd import VersionCmd
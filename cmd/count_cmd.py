@@ -1,13 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from cmd.sql_cmd import SqlCmd
-from core.core import Query
+from core import pool
+from core.core import DatabaseType, Query, ServerFactory
+from core.mongo_query import MongoQuery
+
+# 统计所有表的行数
+ALL_TABLES = '*'
+# 并行统计所有表的精确行数时默认的连接数
+COUNT_WORKERS = 4
 
 
 class CountCmd(SqlCmd):
     name = 'count'
 
+    @property
+    def estimate(self):
+        """
+            单表默认统计精确行数，所有表默认读取估算的行数
+        """
+        count_mode = self.params['count_mode']
+        return count_mode == 'estimate' or count_mode is None and self.params['option_val'] == ALL_TABLES
+
+    def list_tables(self, server, conn):
+        dc = server.db_conf
+        if dc.server_type is DatabaseType.MONGO:
+            # 视图不支持estimated_document_count和collStats，只返回集合
+            query = MongoQuery(None, 'list_collection_names', kwargs={'filter': {'type': 'collection'}})
+            return sorted(query.execute(conn, dc.database))
+        sql = server.get_list_tables_sql(dc.database)
+        tab_list = self._exe_query(sql, conn)[1]
+        return [tab[0] for tab in tab_list[0]] if tab_list else []
+
+    def count_table(self, server, conn, tab_name, estimate=False):
+        dc = server.db_conf
+        sql = server.get_estimated_count_sql(dc.database, tab_name) if estimate else server.get_count_table_sql(tab_name)
+        if dc.server_type is DatabaseType.MONGO:
+            return MongoQuery.parse(sql).execute(conn, dc.database)
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+            row = cur.fetchone()
+            return row[-1] if row else None
+        finally:
+            cur.close()
+
+    def estimate_table(self, server, conn, tab_name):
+        """
+            读取一张表的估算行数，失败时输出错误信息并返回None，不影响其他表
+        """
+        try:
+            return self.count_table(server, conn, tab_name, True)
+        except Exception as e:
+            self.printer.print_error_msg(f'{tab_name}: {e}')
+            return None
+
+    def parallel_count(self, server, tab_names):
+        """
+            多个连接并行统计每张表的精确行数，返回[[表名, 行数]]
+        """
+        workers, local, connections, lock = pool.limit_workers(self.params['workers'] or COUNT_WORKERS), \
+            threading.local(), [], threading.Lock()
+
+        def _count(tab_name):
+            # 每个线程使用自己的连接
+            if not hasattr(local, 'server'):
+                local.server = ServerFactory.get_server(server.db_conf)
+                with lock:
+                    connections.append(local.server.get_connection())
+            return [tab_name, self.count_table(local.server, local.server.get_connection(), tab_name)]
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(_count, tab_names))
+        finally:
+            for c in connections:
+                c.close()
+
     def exe(self):
         tab_name, server = self.params['option_val'], self.get_server()
-        sql = server.get_count_table_sql(tab_name)
         dc, conn = server.db_conf, server.get_connection()
-        self._run_sql(Query(dc.server_type, dc.database, sql, tab_name, False), conn)
-        conn.close()
+        try:
+            if tab_name != ALL_TABLES:
+                sql = server.get_estimated_count_sql(dc.database, tab_name) if self.estimate \
+                    else server.get_count_table_sql(tab_name)
+                self._run_sql(Query(dc.server_type, dc.database, sql, tab_name, False), conn)
+            elif self.estimate and dc.server_type is not DatabaseType.MONGO:
+                # 一条查询读取所有表的估算行数
+                sql = server.get_estimated_count_sql(dc.database)
+                self._run_sql(Query(dc.server_type, dc.database, sql, None, False), conn)
+            else:
+                tab_names = self.list_tables(server, conn)
+                if self.estimate:
+                    res = [[t, self.estimate_table(server, conn, t)] for t in tab_names]
+                else:
+                    # 每个线程使用自己的连接，先归还主连接，守护进程的连接池中才有足够的连接
+                    server.release_connection()
+                    res = self.parallel_count(server, tab_names)
+                self.print_result_set(['table_name', 'row_count'], res,
+                                      Query(dc.server_type, dc.database, None, None, False))
+                self.write_ok_history(f'count {tab_name}')
+        except Exception as e:
+            self.write_error_history(f'count {tab_name}')
+            self.printer.print_error_msg(e)
+        finally:
+            server.release_connection()
@@ -0,0 +1,234 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import core.print_utils as pu
+from cmd.cmd import Cmd
+from cmd.info_cmd import InfoCmd
+from core import pool
+
+SOCKET_FILE = 'config/.db.sock'
+# 守护进程运行时转发给它执行的操作
+DAEMON_OPTION_SET = {'sql', 'scan', 'peek', 'count', 'desc', 'show', 'export', 'stats'}
+# Windows没有Unix域套接字和fork，不支持守护进程
+DAEMON_SUPPORTED = hasattr(socketserver, 'UnixStreamServer') and hasattr(os, 'fork')
+# 帧格式: 通道(o:标准输出, e:错误输出, x:退出码) + 内容长度 + 内容
+FRAME_HEAD = struct.Struct('!cI')
+
+
+def get_socket_path(proc_home=None):
+    return os.path.join(proc_home if proc_home else os.path.dirname(os.path.abspath(sys.argv[0])), SOCKET_FILE)
+
+
+class FrameWriter:
+    """
+        把输出按帧写到socket，作为MsgPrinter的输出使用
+    """
+
+    def __init__(self, sock, channel, lock):
+        self.__sock = sock
+        self.__channel = channel
+        self.__lock = lock
+
+    def write(self, data):
+        if data:
+            payload = data.encode('UTF-8') if isinstance(data, str) else data
+            with self.__lock:
+                self.__sock.sendall(FRAME_HEAD.pack(self.__channel, len(payload)) + payload)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _request_daemon(request, sock_path=None):
+    """
+        发送请求并把守护进程返回的输出写到标准输出，返回退出码，守护进程不可用时返回None
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_path if sock_path else get_socket_path())
+        sock.sendall(f'{json.dumps(request)}\n'.encode('UTF-8'))
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rb') as frames:
+        while True:
+            head = frames.read(FRAME_HEAD.size)
+            if len(head) < FRAME_HEAD.size:
+                sys.stderr.write('Daemon Connection Lost!\n')
+                return 1
+            channel, length = FRAME_HEAD.unpack(head)
+            payload = frames.read(length)
+            if channel == b'x':
+                return int(payload)
+            out = sys.stdout if channel == b'o' else sys.stderr
+            out.flush()
+            out.buffer.write(payload)
+            out.buffer.flush()
+
+
+def _ping(sock_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def forward_to_daemon(opt, params):
+    """
+        守护进程运行时把命令交给守护进程执行，返回退出码，不能转发时返回None
+    """
+    if not DAEMON_SUPPORTED or opt not in DAEMON_OPTION_SET or not os.path.exists(get_socket_path()):
+        return None
+    request_params = {k: v for k, v in params.items() if k not in {'printer', 'print_conf'}}
+    for path_param in ('out', 'export_dir'):
+        if request_params.get(path_param):
+            request_params[path_param] = os.path.abspath(request_params[path_param])
+    return _request_daemon({'op': 'run', 'opt': opt, 'params': request_params})
+
+
+if DAEMON_SUPPORTED:
+    class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        daemon_cmd = None
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        lock, code = threading.Lock(), 0
+        out, err = FrameWriter(self.request, b'o', lock), FrameWriter(self.request, b'e', lock)
+        try:
+            self.server.daemon_cmd.handle_request(json.loads(line), out, err)
+        except SystemExit as se:
+            code = se.code if isinstance(se.code, int) else 1
+        except BaseException as be:
+            err.write(f'{be}\n')
+            code = 1
+        finally:
+            pool.POOL_MANAGER.release_thread_connections()
+        try:
+            with lock:
+                payload = str(code).encode('UTF-8')
+                self.request.sendall(FRAME_HEAD.pack(b'x', len(payload)) + payload)
+        except OSError:
+            pass
+
+
+class DaemonCmd(InfoCmd):
+    name = 'daemon'
+
+    def handle_request(self, request, out, err):
+        printer = pu.MsgPrinter(normal_out=out, msg_out=out, error_out=err)
+        if request['op'] == 'status':
+            pu.print_table(['servertype', 'host', 'port', 'database', 'user', 'idle', 'inUse'],
+                           pool.POOL_MANAGER.stats(), self.params['print_conf'], printer,
+                           lambda t, p: p.print_info_msg('Connection Pools:'))
+        elif request['op'] == 'stop':
+            printer.print_info_msg('Daemon Stopped.')
+            threading.Thread(target=self.__server.shutdown).start()
+        elif request['op'] == 'run':
+            params, print_conf = request['params'], pu.PrintConf()
+            if not params.pop('color', True):
+                print_conf.disable_color()
+                printer.disable_info_color()
+                printer.disable_warn_color()
+            params['limit_rows'] = tuple(params['limit_rows']) if params.get('limit_rows') else None
+            params.update(printer=printer, print_conf=print_conf)
+            try:
+                if params.get('out'):
+                    printer.open_out(params['out'], params.get('resume', False))
+                Cmd.get(request['opt'])(opt=request['opt'], **params).exe()
+            except Exception as ex:
+                printer.print_error_msg(ex)
+            finally:
+                printer.close()
+        printer.flush()
+
+    def _reap_idle(self, interval):
+        while True:
+            time.sleep(interval)
+            pool.POOL_MANAGER.close_idle()
+
+    def _serve(self, daemon_conf):
+        idle_timeout = daemon_conf.get('idle_timeout', 300)
+        pool.POOL_MANAGER = pool.PoolManager(daemon_conf.get('pool_size', 4), idle_timeout,
+                                             daemon_conf.get('acquire_timeout', 60))
+        sock_path = get_socket_path(self.get_proc_home())
+        if os.path.exists(sock_path):
+            os.remove(sock_path)
+        # 只有当前用户能连接守护进程，在创建套接字文件时就限制权限
+        old_umask = os.umask(0o177)
+        try:
+            self.__server = _DaemonServer(sock_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.__server.daemon_cmd = self
+        threading.Thread(target=self._reap_idle, args=(max(min(idle_timeout, 30), 1),), daemon=True).start()
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+            pool.POOL_MANAGER.close_idle(force=True)
+            if os.path.exists(sock_path):
+                os.remove(sock_path)
+
+    def start(self):
+        sock_path = get_socket_path(self.get_proc_home())
+        if _ping(sock_path):
+            self.printer.print_warn_msg('Daemon Is Running!')
+            return
+        daemon_conf = self._read_info().get('daemon', {})
+        self.printer.flush()
+        pid = os.fork()
+        if pid > 0:
+            os.waitpid(pid, 0)
+            for _ in range(50):
+                if os.path.exists(sock_path):
+                    self.printer.print_info_msg('Daemon Started.')
+                    return
+                time.sleep(0.1)
+            self.printer.print_error_msg('Daemon Start Failed!')
+            return
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        with open(os.devnull, 'r+') as devnull:
+            for f in (sys.stdin, sys.stdout, sys.stderr):
+                os.dup2(devnull.fileno(), f.fileno())
+        try:
+            self._serve(daemon_conf)
+        finally:
+            os._exit(0)
+
+    def exe(self):
+        action = self.params['option_val'].lower() if self.params['option_val'] else 'status'
+        if not DAEMON_SUPPORTED:
+            self.printer.print_error_msg('Daemon Is Not Supported On This Platform!')
+            self.write_error_history(action)
+            return
+        sock_path = get_socket_path(self.get_proc_home())
+        if action == 'start':
+            self.start()
+        elif action in {'stop', 'status'}:
+            if _request_daemon({'op': action}, sock_path) is None:
+                self.printer.print_warn_msg('Daemon Is Not Running.')
+        else:
+            self.printer.print_error_msg(f'Invalid Param "{action}"!')
+            self.write_error_history(action)
+            return
+        self.write_ok_history(action)
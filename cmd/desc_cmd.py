@@ -14,6 +14,104 @@ class DescCmd(SqlCmd):
         return {fmt[0]: fmt for fmt in index_formation[0]} if index_formation else dict(), \
                {fmt[0]: fmt for fmt in index_formation[0] if fmt[2] == 'FK'} if index_formation else dict()
 
+    def get_primary_key(self, conn, qy: Query):
+        """
+            返回表的主键列名列表，没有主键时返回空列表
+        """
+        if qy.server_type is DatabaseType.SQL_SERVER:
+            index_dict = self.get_sqlserver_index_information_dict(conn, qy.table_name)[0]
+            return [k for k, v in index_dict.items() if v[2] == 'PK']
+        res = self._exe_query(
+            f"""SELECT COLUMN_NAME FROM information_schema.columns WHERE table_schema='{qy.database}' AND table_name='{qy.table_name}' AND COLUMN_KEY='PRI' ORDER BY ORDINAL_POSITION""",
+            conn)[1]
+        return [row[0] for row in res[0]] if res else []
+
+    def load_sqlserver_catalog(self, conn, tab_name=None, dbo='dbo'):
+        """
+            用几条批量查询读取schema中所有表(或者指定的一张表)的列、约束、自增列、默认值、计算列和注释，
+            返回{表名: {'schema': schema, 'columns': [列信息], 'index': {列名: 约束}, 'foreign': {列名: 外键}, 'comments': [注释]}}
+        """
+        t_filter, c_filter, o_filter = (f" AND t.name='{tab_name}'", f" AND c.TABLE_NAME='{tab_name}'",
+                                        f" AND obj.name='{tab_name}'") if tab_name else ('', '', '')
+        sql = f"""SELECT t.name,s.name,c.name,ic.IS_NULLABLE,ic.DATA_TYPE,ic.CHARACTER_MAXIMUM_LENGTH,ic.NUMERIC_PRECISION,ic.NUMERIC_SCALE,cc.definition,CASE WHEN idc.column_id IS NULL THEN 0 ELSE 1 END,CONVERT(decimal(38,0),idc.seed_value),CONVERT(decimal(38,0),idc.increment_value),dc.definition FROM sys.tables t JOIN sys.schemas s ON s.schema_id=t.schema_id JOIN sys.columns c ON c.object_id=t.object_id JOIN information_schema.columns ic ON ic.TABLE_SCHEMA=s.name AND ic.TABLE_NAME=t.name AND ic.COLUMN_NAME=c.name LEFT JOIN sys.computed_columns cc ON cc.object_id=c.object_id AND cc.column_id=c.column_id LEFT JOIN sys.identity_columns idc ON idc.object_id=c.object_id AND idc.column_id=c.column_id LEFT JOIN sys.default_constraints dc ON dc.parent_object_id=c.object_id AND dc.parent_column_id=c.column_id WHERE s.name='{dbo}'{t_filter} ORDER BY t.name,c.column_id;\
+    SELECT t.name tabName,c.name colName,object_name(constraint_object_id) constName,'FK' type,object_name(referenced_object_id) refTabName,c1.name refColName FROM sys.foreign_key_columns f JOIN sys.tables t ON t.object_id=f.parent_object_id JOIN sys.columns c ON c.object_id=f.parent_object_id AND c.column_id=f.parent_column_id JOIN sys.columns c1 ON c1.object_id=f.referenced_object_id AND c1.column_id=f.referenced_column_id JOIN sys.schemas s ON t.schema_id=s.schema_id WHERE s.name='{dbo}'{t_filter} \
+    UNION ALL SELECT c.TABLE_NAME tabName,COLUMN_NAME colName,CONSTRAINT_NAME constName,k.type,NULL refTabName,NULL refColName FROM sys.key_constraints k LEFT JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE c ON k.name=c.CONSTRAINT_NAME WHERE c.TABLE_SCHEMA='{dbo}'{c_filter};\
+    SELECT obj.name,col.name,CONVERT(varchar,ep.value),ep.name comment,CONVERT(varchar,SQL_VARIANT_PROPERTY(ep.value,'BaseType')) type,ep.minor_id FROM dbo.syscolumns col JOIN dbo.sysobjects obj ON col.id=obj.id AND obj.xtype='U' AND obj.status>=0 JOIN sys.extended_properties ep ON col.id=ep.major_id AND col.colid=ep.minor_id WHERE ep.value IS NOT NULL{o_filter} \
+    UNION SELECT obj.name,obj.name,CONVERT(varchar,ep.value),ep.name comment,CONVERT(varchar,SQL_VARIANT_PROPERTY(ep.value,'BaseType')) type,ep.minor_id FROM dbo.sysobjects obj JOIN sys.extended_properties ep ON obj.id=ep.major_id WHERE ep.minor_id=0 AND obj.xtype='U' AND obj.status>=0{o_filter} ORDER BY 1,6"""
+        res = self._exe_query(sql, conn)[1]
+        if len(res) < 3:
+            return {}
+        catalog = {}
+        for row in res[0]:
+            table = catalog.setdefault(row[0], {'schema': row[1], 'columns': [], 'index': {}, 'foreign': {},
+                                                'comments': []})
+            # (colName,nullable,dataType,maxLength,precision,scale,computedDefinition,isIdentity,seed,incr,default)
+            table['columns'].append(row[2:])
+        for row in res[1]:
+            if row[0] in catalog:
+                # {colName:(colName,constName,indexType,refTabName,refColName)}
+                catalog[row[0]]['index'][row[1]] = row[1:]
+                if row[3] == 'FK':
+                    catalog[row[0]]['foreign'][row[1]] = row[1:]
+        for row in res[2]:
+            if row[0] in catalog:
+                # (name,value,propertyName,type,minorId)
+                catalog[row[0]]['comments'].append(row[1:])
+        return catalog
+
+    def get_sqlserver_ddl(self, tab_name, table):
+        """
+            根据load_sqlserver_catalog读取的表信息生成建表语句
+        """
+
+        def is_number(_data_type):
+            return _data_type in {'bit', 'int', 'tinyint', 'smallint', 'bigint', 'float',
+                                  'decimal', 'numeric', 'real', 'money', 'smallmoney'}
+
+        res_list, schema, columns = [], table['schema'], table['columns']
+        primary_key, mul_unique = [], {}
+        for k, v in table['index'].items():
+            if v[2] == 'PK':
+                primary_key.append(f'[{k}]')
+            elif v[2] == 'UQ':
+                mul_unique[v[1]] = l = mul_unique.get(v[1], [])
+                l.append(f'[{k}]')
+        res_list.append(f"CREATE TABLE [{schema}].[{tab_name}] (\n")
+        for index, (col_name, nullable, data_type, cml, np, ns, definition, is_identity, id_seed, id_incr,
+                    default) in enumerate(columns):
+            if definition:
+                res_list.append(f"  [{col_name}] AS {definition}")
+            else:
+                res_list.append(f"  [{col_name}] {data_type}")
+                if cml is not None and data_type not in ('text', 'ntext', 'xml'):
+                    res_list.append(f"({'max' if cml == -1 else cml})")
+                elif data_type in ('decimal', 'numeric'):
+                    res_list.append(f"({np},{ns})")
+                if is_identity:
+                    res_list.append(f" IDENTITY({id_seed},{id_incr})")
+                if default is not None:
+                    res_list.append(f" DEFAULT {default}")
+                if nullable == 'NO':
+                    res_list.append(" NOT NULL")
+            if index == len(columns) - 1:
+                res_list.append(f",\n  PRIMARY KEY({','.join(primary_key)})" if primary_key else '')
+                res_list.append(',\n' if mul_unique else '')
+                res_list.append(',\n'.join([f"  CONSTRAINT [{k}] UNIQUE({','.join(v)})" for k, v in mul_unique.items()]))
+                res_list.append('\n')
+            else:
+                res_list.append(",\n")
+        res_list.append(");")
+        for com in table['comments']:
+            res_list.append(
+                f"""\nEXEC sp_addextendedproperty '{com[2]}' , {com[1] if is_number(com[3]) else "'{}'".format(com[1])}, 'SCHEMA', '{schema}', 'TABLE', '{tab_name}';""" if
+                com[4] == 0 else
+                f"""\nEXEC sp_addextendedproperty '{com[2]}' , {com[1] if is_number(com[3]) else "'{}'".format(com[1])}, 'SCHEMA', '{schema}', 'TABLE', '{tab_name}', 'COLUMN', '{com[0]}';""")
+        for k, v in table['foreign'].items():
+            res_list.append(
+                f'\nALTER TABLE [{schema}].[{tab_name}] WITH CHECK ADD CONSTRAINT [{v[1]}] FOREIGN KEY([{k}]) REFERENCES [{schema}].[{v[3]}] ([{v[4]}]);\n')
+            res_list.append(f'ALTER TABLE [{schema}].[{tab_name}] CHECK CONSTRAINT [{v[1]}];')
+        return ''.join(res_list)
+
     def print_table_description(self, conn, qy: Query):
         sql = f"""SELECT COLUMN_NAME,COLUMN_TYPE,IS_NULLABLE,COLUMN_KEY,COLUMN_DEFAULT,EXTRA,COLUMN_COMMENT FROM information_schema.columns WHERE table_schema='{qy.database}' AND table_name='{qy.table_name}'"""
         if qy.server_type is DatabaseType.SQL_SERVER:
@@ -49,7 +147,7 @@ class DescCmd(SqlCmd):
                 row[4] = '' if row[4] is None else row[4]
         self.print_result_set(['Name', 'Type', 'Nullable', 'Key', 'Default', 'Extra', 'Comment'], res, qy)
 
-    def get_create_table_ddl(self, conn, query: Query):
+    def get_create_table_ddl(self, conn, query: Query, catalog=None):
         def get_create_table_mysql_ddl():
             res = self._exe_no_query(f'show create table {query.table_name}', conn)[2]
             if not res:
@@ -57,81 +155,21 @@ class DescCmd(SqlCmd):
             return res[0][0][1] if len(res[0][0]) == 2 else res[0][0][0]
 
         def get_create_table_sql_server_ddl():
-            def is_number(_data_type):
-                return _data_type in {'bit', 'int', 'tinyint', 'smallint', 'bigint', 'float',
-                                      'decimal', 'numeric', 'real', 'money', 'smallmoney'}
-
-            res_list = []
-            sql = f"""sp_columns {query.table_name};SELECT TABLE_CATALOG,TABLE_SCHEMA,TABLE_NAME,ic.IS_NULLABLE,DATA_TYPE,CHARACTER_MAXIMUM_LENGTH,NUMERIC_PRECISION,NUMERIC_SCALE,tmp.definition FROM information_schema.columns ic LEFT JOIN (SELECT c.name col,c.definition FROM sys.computed_columns c \
-    JOIN sys.tables t ON c.object_id=t.object_id JOIN sys.schemas s ON s.schema_id=t.schema_id WHERE t.name='{query.table_name}' AND s.name='dbo') tmp ON ic.COLUMN_NAME=tmp.col WHERE ic.TABLE_NAME='{query.table_name}' AND ic.TABLE_SCHEMA='dbo'"""
-            effect_rows, description, res, success = self._exe_no_query(sql, conn)
-            if not res or not res[0]:
+            if catalog is None:
+                table = next(iter(self.load_sqlserver_catalog(conn, query.table_name).values()), None)
+            else:
+                table = catalog.get(query.table_name)
+            if not table:
                 self.printer.print_error_msg(f"{query.table_name} not found!")
                 return
-            header2, res1 = self.before_print(self._get_table_head_from_description(description[1]), res[1], query)
-            header, res2 = self.before_print(self._get_table_head_from_description(description[0]), res[0], query)
-            index_dict, foreign_dict = self.get_sqlserver_index_information_dict(conn, query.table_name)
-            primary_key, mul_unique = [], {}
-            for k, v in index_dict.items():
-                if v[2] == 'PK':
-                    primary_key.append(f'[{k}]')
-                elif v[2] == 'UQ':
-                    mul_unique[v[1]] = l = mul_unique.get(v[1], [])
-                    l.append(f'[{k}]')
-            res_list.append(f"CREATE TABLE [{res1[0][1]}].[{query.table_name}] (\n")
-            for index, (row, row2) in enumerate(zip(res1, res2)):
-                col_name, data_type = row2[3], row[4]
-                if row[8]:
-                    res_list.append(f"  [{col_name}] AS {row[8]}")
-                else:
-                    res_list.append(f"  [{col_name}] {data_type}")
-                    if row[5] is not None and data_type not in ('text', 'ntext', 'xml'):
-                        res_list.append(f"({'max' if row[5] == -1 else row[5]})")
-                    elif data_type in ('decimal', 'numeric'):
-                        res_list.append(f"({row[6]},{row[7]})")
-                    if row2[5].endswith("identity"):
-                        id_seed, id_incr = \
-                            self._exe_no_query(
-                                f"SELECT IDENT_SEED('{query.table_name}'),IDENT_INCR('{query.table_name}')",
-                                conn)[
-                                2][
-                                0][0]
-                        res_list.append(f" IDENTITY({id_seed},{id_incr})")
-                    if row2[12] is not None:
-                        res_list.append(f" DEFAULT {row2[12]}")
-                    if row[3] == 'NO':
-                        res_list.append(" NOT NULL")
-                if index == len(res1) - 1:
-                    res_list.append(f",\n  PRIMARY KEY({','.join(primary_key)})" if primary_key else '')
-                    res_list.append(',\n' if mul_unique else '')
-                    res_list.append(
-                        ',\n'.join([f"  CONSTRAINT [{k}] UNIQUE({','.join(v)})" for k, v in mul_unique.items()]))
-                    res_list.append('\n')
-                else:
-                    res_list.append(",\n")
-            res_list.append(");")
-            comment = self._exe_query(
-                f"""(SELECT col.name,CONVERT(varchar,ep.value),ep.name comment,CONVERT(varchar,SQL_VARIANT_PROPERTY(ep.value,'BaseType')) type,ep.minor_id FROM dbo.syscolumns col JOIN dbo.sysobjects obj ON col.id=obj.id AND obj.xtype='U' AND obj.status>=0 LEFT JOIN sys.extended_properties ep ON col.id=ep.major_id AND col.colid=ep.minor_id \
-                 WHERE obj.name='{query.table_name}' AND ep.value is not NULL) union (select obj.name,CONVERT(varchar,ep.value),ep.name comment,CONVERT(varchar,SQL_VARIANT_PROPERTY(ep.value,'BaseType')) type,ep.minor_id from dbo.sysobjects obj join sys.extended_properties ep on obj.id=ep.major_id where ep.minor_id=0 and obj.xtype='U' AND obj.status>=0 AND obj.name='{query.table_name}')""",
-                conn)[1]
-            if comment:
-                for com in comment[0]:
-                    res_list.append(
-                        f"""\nEXEC sp_addextendedproperty '{com[2]}' , {com[1] if is_number(com[3]) else "'{}'".format(com[1])}, 'SCHEMA', '{res1[0][1]}', 'TABLE', '{query.table_name}';""" if
-                        com[4] == 0 else
-                        f"""\nEXEC sp_addextendedproperty '{com[2]}' , {com[1] if is_number(com[3]) else "'{}'".format(com[1])}, 'SCHEMA', '{res1[0][1]}', 'TABLE', '{query.table_name}', 'COLUMN', '{com[0]}';""")
-            for k, v in foreign_dict.items():
-                res_list.append(
-                    f'\nALTER TABLE [{res1[0][1]}].[{query.table_name}] WITH CHECK ADD CONSTRAINT [{v[1]}] FOREIGN KEY([{k}]) REFERENCES [{res1[0][1]}].[{v[3]}] ([{v[4]}]);\n')
-                res_list.append(f'ALTER TABLE [{res1[0][1]}].[{query.table_name}] CHECK CONSTRAINT [{v[1]}];')
-            return ''.join(res_list)
+            return self.get_sqlserver_ddl(query.table_name, table)
 
         if query.server_type is DatabaseType.MYSQL:
             return get_create_table_mysql_ddl()
         if query.server_type is DatabaseType.SQL_SERVER:
             return get_create_table_sql_server_ddl()
 
-    def _print_table_schema(self, conn, query, attach_sql=False):
+    def _print_table_schema(self, conn, query, attach_sql=False, catalog=None):
         if query.server_type is DatabaseType.MONGO:
             self.printer.print_error_msg("Not Support MongoDB!")
             self.write_error_history("Not Support MongoDB")
@@ -141,7 +179,7 @@ class DescCmd(SqlCmd):
             if not attach_sql:
                 return
         if self.out_format in {'sql', 'markdown'}:
-            ddl = self.get_create_table_ddl(conn, query)
+            ddl = self.get_create_table_ddl(conn, query, catalog)
             self.printer.output(f'\n```sql\n{ddl}\n```' if self.out_format == 'markdown' else ddl)
 
     def exe(self):
@@ -1,5 +1,30 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import core.print_utils as pu
 from cmd.desc_cmd import DescCmd
-from core.core import DatabaseType, Query
+from core import pool
+from core.core import DatabaseType, Query, ServerFactory
+from core.mongo_query import MongoQuery
+
+# 按目录导出时每种格式对应的文件后缀
+FORMAT_FILE_EXT = {'table': 'txt', 'text': 'txt', 'json': 'json', 'ndjson': 'ndjson', 'jsonl': 'jsonl', 'sql': 'sql',
+                   'html': 'html', 'html2': 'html', 'html3': 'html', 'html4': 'html', 'markdown': 'md', 'xml': 'xml',
+                   'csv': 'csv', 'tsv': 'tsv'}
+MANIFEST_FILE = 'manifest.json'
+# 能按主键分块导出的格式，这些格式没有表头，多个分块的输出拼接后仍然是完整的结果
+CHUNK_FORMAT_SET = {'sql', 'ndjson', 'jsonl'}
+# 按目录导出时默认的并行连接数
+EXPORT_WORKERS = 4
+# MongoDB导出的格式，文档编码成扩展JSON
+MONGO_FORMAT_SET = {'ndjson', 'jsonl', 'json'}
+# MongoDB按_id范围并行扫描时每个范围的目标文档数
+MONGO_RANGE_DOCS = 100000
 
 
 def get_print_template(out_format):
@@ -11,47 +36,322 @@ def get_print_template(out_format):
         return '--\n-- {}\n--\n\n'
 
 
+def get_table_file_name(tab_name, out_format):
+    safe_name = ''.join('_' if c in '/\\\0' else c for c in tab_name)
+    return f'{safe_name}.{FORMAT_FILE_EXT.get(out_format, "txt")}'
+
+
+class ExportCheckpoint:
+    """
+        导出进度的检查点，记录已经导出完成的表，以及正在导出的表最后一个完成分块的主键和输出文件的位置
+    """
+
+    def __init__(self, path, printer, resume=False):
+        self.__path = path
+        self.__printer = printer
+        self.__state = {'done': [], 'table': None, 'lastKey': None, 'offset': 0}
+        if resume:
+            if os.path.exists(path):
+                with open(path, mode='r', encoding='UTF-8') as f:
+                    self.__state = json.load(f)
+            # 丢弃最后一个检查点之后写入的不完整的内容
+            printer.truncate(self.__state['offset'])
+
+    def is_done(self, tab_name):
+        return tab_name in self.__state['done']
+
+    def resume_key(self, tab_name):
+        """
+            返回表上次导出到的主键字面量，表没有导出过分块时返回None
+        """
+        return self.__state['lastKey'] if self.__state['table'] == tab_name else None
+
+    def save(self, tab_name, last_key=None):
+        self.__state.update(table=tab_name, lastKey=last_key, offset=self.__printer.tell())
+        tmp_path = f'{self.__path}.tmp'
+        with open(tmp_path, mode='w', encoding='UTF-8') as f:
+            json.dump(self.__state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.__path)
+
+    def finish(self, tab_name):
+        self.__state['done'].append(tab_name)
+        self.save(None)
+
+    def remove(self):
+        ExportCheckpoint.remove_file(self.__path)
+
+    @staticmethod
+    def remove_file(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 class ExportCmd(DescCmd):
     name = 'export'
+    stream_fetch = True
 
     @property
     def export_type(self):
         return self.params['export_type']
 
-    def exe(self):
+    def get_keyset_column(self, server, conn, tab_name, table=None):
+        """
+            返回用来分块导出的主键列，只支持单列主键，不能分块导出时返回None，
+            table是load_sqlserver_catalog读取的表信息，有表信息时不再单独查询主键和列类型
+        """
+        if self.params['export_chunk_size'] <= 0 or self.out_format not in CHUNK_FORMAT_SET:
+            return None
+        dc = server.db_conf
+        if table:
+            primary_key = [k for k, v in table['index'].items() if v[2] == 'PK']
+            column_types = {col[0]: col[2] for col in table['columns']}
+        else:
+            primary_key = self.get_primary_key(conn, Query(dc.server_type, dc.database, None, tab_name))
+            column_types = None
+        if len(primary_key) != 1:
+            return None
+        data_type = (column_types or dict(server.get_table_columns(tab_name))).get(primary_key[0])
+        return primary_key[0] if server.can_keyset(data_type) else None
+
+    def _track_rows(self, rows, chunk):
+        for row in rows:
+            chunk[0] += 1
+            chunk[1] = row
+            yield row
+
+    def export_chunks(self, server, conn, tab_name, key_column, last_key, checkpoint=None):
+        """
+            按主键范围分块导出表数据，每次只读取chunk_size行，每个分块导出完成后记录检查点
+        """
+        dc, chunk_size = server.db_conf, self.params['export_chunk_size']
+        while True:
+            q = Query(dc.server_type, dc.database, server.get_keyset_sql(tab_name, key_column, last_key, chunk_size),
+                      tab_name, self.fold)
+            cur = self._get_cursor(conn, dc.server_type, True)
+            cur.execute(q.sql)
+            header, chunk = self._get_table_head_from_description(cur.description), [0, None]
+            rows = self._fetch_iter(cur)
+            first_row = next(rows, None)
+            if first_row is not None:
+                self.print_result_set(header, self._track_rows(chain((first_row,), rows), chunk), q, 0,
+                                      cur.description)
+            for _ in rows:
+                pass
+            cur.close()
+            if chunk[0] < chunk_size:
+                break
+            last_key = server.key_literal(chunk[1][header.index(key_column)])
+            if checkpoint:
+                checkpoint.save(tab_name, last_key)
+        self.write_ok_history(server.get_keyset_sql(tab_name, key_column, None, chunk_size))
+
+    def get_mongo_ranges(self, collection, workers):
+        """
+            用$sample采样_id，把集合按_id分成多个范围，返回每个范围的查询条件。
+            范围查询只匹配同类型的_id，所以只按ObjectId分块，并单独扫描_id不是ObjectId的文档
+        """
+        from bson import ObjectId
+        range_num = min(workers * 4, collection.estimated_document_count() // MONGO_RANGE_DOCS + 1)
+        if range_num <= 1:
+            return [{}]
+        ids = [d['_id'] for d in collection.aggregate([{'$sample': {'size': range_num * 32}}, {'$project': {'_id': 1}}])]
+        if not ids or not all(isinstance(i, ObjectId) for i in ids):
+            return [{}]
+        ids.sort()
+        bounds = sorted({ids[i * len(ids) // range_num] for i in range(1, range_num)})
+        return [{'_id': {'$lt': bounds[0]}}] + \
+            [{'_id': {'$gte': low, '$lt': high}} for low, high in zip(bounds, bounds[1:])] + \
+            [{'_id': {'$gte': bounds[-1]}}, {'_id': {'$not': {'$type': 'objectId'}}}]
+
+    def export_collection(self, server, conn, tab_name, checkpoint=None):
+        """
+            把集合导出成canonical格式的扩展JSON，ndjson每行一个文档，json和其他格式一样每个文档单独缩进输出，
+            大集合分成多个_id范围在客户端的连接池上并行扫描，文档之间的顺序不固定
+        """
+        from bson import json_util
+        dc, printer, lock = server.db_conf, self.printer, threading.Lock()
+        collection, fetch_size = conn[dc.database][tab_name], self.params['fetch_size']
+        workers = self.params['workers'] or EXPORT_WORKERS
+        indent = 2 if self.out_format == 'json' else None
+        # canonical格式保留Int64、Decimal128等类型，load后和原来的数据一致
+        options = json_util.CANONICAL_JSON_OPTIONS
+
+        def _scan(query):
+            lines = []
+            for doc in collection.find(query, batch_size=fetch_size):
+                lines.append(json_util.dumps(doc, json_options=options, indent=indent, ensure_ascii=False))
+                if len(lines) >= fetch_size:
+                    with lock:
+                        printer.output_lines(lines)
+                    lines = []
+            if lines:
+                with lock:
+                    printer.output_lines(lines)
+
+        # 集合没有导出完成时从集合开始的位置重新导出
+        if checkpoint:
+            checkpoint.save(tab_name)
+        ranges = self.get_mongo_ranges(collection, workers)
+        with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            list(executor.map(_scan, ranges))
+        self.write_ok_history(str(MongoQuery(tab_name, 'find')))
+        if checkpoint:
+            checkpoint.finish(tab_name)
+
+    def export_table(self, server, conn, tab_name, checkpoint=None, catalog=None):
         out_format, fold, export_type, printer = self.out_format, self.fold, self.export_type, self.printer
-        server = self.get_server()
         dc = server.db_conf
         if dc.server_type is DatabaseType.MONGO:
-            printer.print_error_msg("Not Support MongoDB!")
-            self.write_error_history("Not Support MongoDB")
+            self.export_collection(server, conn, tab_name, checkpoint)
+            return
+        split_line, print_template = '\n---\n' if out_format == 'markdown' else '\n', get_print_template(out_format)
+        # 从检查点继续导出时表结构和已经导出的分块不再重复输出
+        last_key = checkpoint.resume_key(tab_name) if checkpoint else None
+        if checkpoint and last_key is None:
+            checkpoint.save(tab_name)
+        if export_type in {'all', 'ddl'} and last_key is None:
+            printer.output(print_template.format(f'Table structure for {tab_name}'))
+            self._print_table_schema(conn, Query(dc.server_type, dc.database, None, tab_name, fold),
+                                     export_type == 'ddl', catalog)
+            printer.output(split_line)
+        if export_type in {'all', 'data'}:
+            table = catalog.get(tab_name) if catalog else None
+            key_column = self.get_keyset_column(server, conn, tab_name, table)
+            set_identity_insert = False
+            if dc.server_type is DatabaseType.SQL_SERVER and out_format == 'sql':
+                if table:
+                    # 表信息中的自增列标记
+                    set_identity_insert = any(col[7] for col in table['columns'])
+                else:
+                    results = self._exe_query(f'sp_columns [{tab_name}]', conn)[1]
+                    set_identity_insert = len([1 for row in results[0] if row[5].endswith("identity")]) > 0
+            if last_key is None:
+                printer.output(print_template.format(f'Dumping data for {tab_name}'), end='')
+                if set_identity_insert:
+                    printer.output(f'SET IDENTITY_INSERT [{tab_name}] ON;')
+            if key_column:
+                self.export_chunks(server, conn, tab_name, key_column, last_key, checkpoint)
+            else:
+                q = Query(dc.server_type, dc.database, server.get_scan_table_sql(tab_name), tab_name, fold)
+                self._run_sql(q, conn)
+            if set_identity_insert:
+                printer.output(f'SET IDENTITY_INSERT [{tab_name}] OFF;')
+            printer.output(split_line)
+        if checkpoint:
+            checkpoint.finish(tab_name)
+
+    def _export_table_file(self, server, tab_name, out_dir, catalog=None):
+        """
+            把一张表导出到单独的文件中，返回(文件名, 字节数, 耗时, 错误信息, 状态)
+        """
+        msg_out, error_out = io.StringIO(), io.StringIO()
+        printer = pu.MsgPrinter(normal_out=msg_out, msg_out=msg_out, error_out=error_out)
+        printer.disable_info_color()
+        printer.disable_warn_color()
+        printer.disable_error_color()
+        file_name, start = get_table_file_name(tab_name, self.out_format), time.time()
+        path, stat = os.path.join(out_dir, file_name), 'ok'
+        try:
+            printer.open_out(path, self.params['resume'])
+            checkpoint = ExportCheckpoint(f'{path}.ckpt', printer, self.params['resume']) \
+                if printer.seekable else None
+            if checkpoint and checkpoint.is_done(tab_name):
+                stat = 'skip'
+            else:
+                table_cmd = ExportCmd(self.opt, **{**self.params, 'printer': printer})
+                table_cmd.export_table(server, server.get_connection(), tab_name, checkpoint, catalog)
+        except Exception as e:
+            printer.print_error_msg(e)
+        finally:
+            printer.close()
+        error = error_out.getvalue().strip()
+        return file_name, os.path.getsize(path) if os.path.exists(path) else 0, time.time() - start, error, \
+            'error' if error else stat
+
+    def parallel_export(self, server, tab_names, catalog=None):
+        """
+            多个连接并行导出，每张表单独一个文件，导出目录下生成manifest.json记录每张表的导出信息
+        """
+        out_dir, printer = self.params['export_dir'], self.printer
+        workers = pool.limit_workers(self.params['workers'] or EXPORT_WORKERS)
+        os.makedirs(out_dir, exist_ok=True)
+        local, connections, lock = threading.local(), [], threading.Lock()
+
+        def _export(tab_name):
+            # 每个线程使用自己的连接
+            if not hasattr(local, 'server'):
+                local.server = ServerFactory.get_server(server.db_conf)
+                with lock:
+                    connections.append(local.server.get_connection())
+            return tab_name, *self._export_table_file(local.server, tab_name, out_dir, catalog)
+
+        start, tables = time.time(), []
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for tab_name, file_name, size, seconds, error, stat in executor.map(_export, tab_names):
+                    if error:
+                        printer.print_error_msg(f'{tab_name}: {error}')
+                    tables.append({'table': tab_name, 'file': file_name, 'bytes': size, 'seconds': round(seconds, 3),
+                                   'bytesPerSecond': round(size / seconds) if seconds else 0, 'stat': stat})
+        finally:
+            for c in connections:
+                c.close()
+        success = len([1 for t in tables if t['stat'] == 'error']) == 0
+        if success:
+            for t in tables:
+                ExportCheckpoint.remove_file(os.path.join(out_dir, f"{t['file']}.ckpt"))
+        total_seconds, total_bytes = time.time() - start, sum(t['bytes'] for t in tables)
+        with open(os.path.join(out_dir, MANIFEST_FILE), mode='w', encoding='UTF-8') as manifest:
+            json.dump({'database': server.db_conf.database, 'serverType': server.db_conf.server_type.value,
+                       'exportType': self.export_type, 'format': self.out_format, 'workers': workers,
+                       'seconds': round(total_seconds, 3), 'bytes': total_bytes, 'tables': tables},
+                      manifest, indent=2, ensure_ascii=False)
+        pu.print_table(['table', 'file', 'bytes', 'seconds', 'MB/s', 'stat'],
+                       [[t['table'], t['file'], t['bytes'], t['seconds'], round(t['bytesPerSecond'] / 1048576, 2),
+                         t['stat']] for t in tables], self.params['print_conf'], printer,
+                       lambda table_width, mp: mp.print_info_msg(f'Export To {os.path.abspath(out_dir)}:'))
+        printer.print_info_msg(f'Total: {len(tables)} tables, {total_bytes} bytes, {round(total_seconds, 3)}s, '
+                               f'{round(total_bytes / 1048576 / total_seconds, 2) if total_seconds else 0}MB/s')
+        return success
+
+    def exe(self):
+        export_type, printer = self.export_type, self.printer
+        server = self.get_server()
+        dc = server.db_conf
+        if dc.server_type is DatabaseType.MONGO and (export_type == 'ddl' or self.out_format not in MONGO_FORMAT_SET):
+            printer.print_error_msg("MongoDB Only Supports Exporting Data As ndjson, jsonl or json!")
+            self.write_error_history(export_type)
             return
         conn = server.get_connection()
         try:
-            tab_list = self._exe_query(server.get_list_tables_sql(server.db_conf.database), conn)[1]
-            split_line, print_template = '\n---\n' if out_format == 'markdown' else '\n', get_print_template(out_format)
-            attach_sql = export_type == 'ddl'
-            for tab in tab_list[0]:
-                if export_type in {'all', 'ddl'}:
-                    printer.output(print_template.format(f'Table structure for {tab[0]}'))
-                    self._print_table_schema(conn, Query(dc.server_type, dc.database, None, tab[0], fold), attach_sql)
-                    printer.output(split_line)
-                if export_type in {'all', 'data'}:
-                    q = Query(dc.server_type, dc.database, server.get_scan_table_sql(tab[0]), tab[0], fold)
-                    printer.output(print_template.format(f'Dumping data for {tab[0]}'), end='')
-                    if dc.server_type is DatabaseType.SQL_SERVER and out_format == 'sql':
-                        headers, results = self._exe_query(f'sp_columns [{tab[0]}];{q.sql}', conn)
-                        set_identity_insert = len([1 for row in results[0] if row[5].endswith("identity")]) > 0
-                        if set_identity_insert:
-                            printer.output(f'SET IDENTITY_INSERT [{tab[0]}] ON;')
-                        self.print_result_set(self._get_table_head_from_description(headers[1]), results[1], q)
-                        if set_identity_insert:
-                            printer.output(f'SET IDENTITY_INSERT [{tab[0]}] OFF;')
-                    else:
-                        self._run_sql(q, conn)
-                    printer.output(split_line)
+            if dc.server_type is DatabaseType.MONGO:
+                tab_names = sorted(MongoQuery.parse(server.get_list_tables_sql(dc.database)).execute(conn, dc.database))
+            else:
+                tab_list = self._exe_query(server.get_list_tables_sql(server.db_conf.database), conn)[1]
+                tab_names = [tab[0] for tab in tab_list[0]] if tab_list else []
+            catalog = None
+            if dc.server_type is DatabaseType.SQL_SERVER and (
+                    export_type in {'all', 'ddl'} and self.out_format in {'sql', 'markdown'} or
+                    export_type in {'all', 'data'} and self.out_format in CHUNK_FORMAT_SET):
+                # 一次读取所有表的结构、主键和自增列信息，不再每张表查询多次
+                catalog = self.load_sqlserver_catalog(conn)
+            if self.params['export_dir']:
+                # 每个线程使用自己的连接，先归还主连接，守护进程的连接池中才有足够的连接
+                server.release_connection()
+                if self.parallel_export(server, tab_names, catalog):
+                    self.write_ok_history(export_type)
+                else:
+                    self.write_error_history(export_type)
+                return
+            checkpoint = ExportCheckpoint(f"{self.params['out']}.ckpt", printer, self.params['resume']) \
+                if self.params['out'] and printer.seekable else None
+            for tab_name in tab_names:
+                if checkpoint is None or not checkpoint.is_done(tab_name):
+                    self.export_table(server, conn, tab_name, checkpoint, catalog)
+            if checkpoint:
+                checkpoint.remove()
         except BaseException as be:
             self.write_error_history(export_type)
             printer.print_error_msg(be)
         finally:
-            conn.close()
+            server.release_connection()
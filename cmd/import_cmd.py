@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import re
+
+from cmd.desc_cmd import DescCmd
+from cmd.load_cmd import LoadProgress, insert_mongo_docs
+from core.core import DatabaseType, DbException
+from core.input_utils import InputStream, COMPRESSED_EXT_SET
+
+# 每批导入的行数
+IMPORT_BATCH_ROWS = 1000
+# SQL Server的一条语句最多2100个参数，VALUES最多1000行
+SQL_SERVER_MAX_PARAMS = 2100
+SQL_SERVER_MAX_ROWS = 1000
+# 文件后缀对应的导入格式
+IMPORT_FORMATS = {'csv': 'csv', 'tsv': 'tsv', 'txt': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson', 'json': 'json'}
+_WHITESPACE_RE = re.compile(r'\s*')
+
+
+def get_import_format(path):
+    """
+        按文件后缀返回导入格式，压缩文件使用去掉压缩后缀后的文件名
+    """
+    name, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSED_EXT_SET:
+        name, ext = os.path.splitext(name)
+    return IMPORT_FORMATS.get(ext[1:].lower())
+
+
+class ImportCmd(DescCmd):
+    name = 'import'
+
+    def _read_docs(self, f, file_format):
+        """
+            逐行读取文件，每行返回一个{列名: 值}，csv的第一行是列名，空字符串作为NULL，
+            json文件可以是对象数组，也可以是export导出的连续多个对象，需要一次读入整个文件
+        """
+        if file_format == 'ndjson':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        if file_format == 'json':
+            decoder, text = json.JSONDecoder(), f.read()
+            pos = _WHITESPACE_RE.match(text).end()
+            while pos < len(text):
+                value, pos = decoder.raw_decode(text, pos)
+                pos = _WHITESPACE_RE.match(text, pos).end()
+                if isinstance(value, list):
+                    yield from value
+                else:
+                    yield value
+            return
+        reader = csv.reader(f, delimiter='\t' if file_format == 'tsv' else self.params['csv_delimiter'])
+        header = next(reader, None)
+        for row in reader:
+            yield {k: None if v == '' else v for k, v in zip(header, row)}
+
+    def _batches(self, docs):
+        """
+            连续的字段相同的行作为一批，返回(字段元组, [行])
+        """
+        keys, rows = None, []
+        for doc in docs:
+            doc_keys = tuple(doc.keys())
+            if rows and (doc_keys != keys or len(rows) >= IMPORT_BATCH_ROWS):
+                yield keys, rows
+                rows = []
+            keys = doc_keys
+            rows.append([json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                         for v in doc.values()])
+        if rows:
+            yield keys, rows
+
+    def map_columns(self, server, tab_name, keys):
+        """
+            把文件中的字段按表的列信息映射成表的列名，不区分大小写
+        """
+        table_columns = {c.lower(): c for c, _ in server.get_table_columns(tab_name)}
+        if not table_columns:
+            raise DbException(f'Table {tab_name} Not Exist!')
+        unknown = [k for k in keys if k.lower() not in table_columns]
+        if unknown:
+            raise DbException(f"Unknown Columns: {', '.join(unknown)}!")
+        return [table_columns[k.lower()] for k in keys]
+
+    def _insert_rows(self, cur, server, tab_name, columns, rows):
+        dc = server.db_conf
+        insert_prefix = f"INSERT INTO {server.escape_value(tab_name)} " \
+                        f"({','.join(server.escape_value(c) for c in columns)}) VALUES "
+        placeholder = f"({','.join(['%s'] * len(columns))})"
+        if dc.server_type is DatabaseType.MYSQL:
+            # pymysql会把executemany改写成多行INSERT，并且按max_allowed_packet拆分
+            cur.executemany(f'{insert_prefix}{placeholder}', rows)
+            return
+        batch_rows = max(min(SQL_SERVER_MAX_ROWS, (SQL_SERVER_MAX_PARAMS - 1) // len(columns)), 1)
+        for i in range(0, len(rows), batch_rows):
+            batch = rows[i:i + batch_rows]
+            cur.execute(f"{insert_prefix}{','.join([placeholder] * len(batch))}",
+                        tuple(v for row in batch for v in row))
+
+    def _get_identity_columns(self, conn, tab_name):
+        results = self._exe_query(f'sp_columns [{tab_name}]', conn)[1]
+        return {row[3] for row in results[0] if row[5].endswith("identity")} if results else set()
+
+    def import_sql(self, server, tab_name, docs, progress, read_bytes):
+        """
+            导入到MySQL和SQL Server，每批一个事务，返回(成功行数, 失败行数)
+        """
+        dc, conn = server.db_conf, server.get_connection()
+        cur, success_num, fail_num, columns_cache = conn.cursor(), 0, 0, {}
+        identity_columns, identity_insert = set(), False
+        if dc.server_type is DatabaseType.SQL_SERVER:
+            identity_columns = self._get_identity_columns(conn, tab_name)
+        try:
+            for keys, rows in self._batches(docs):
+                try:
+                    if keys not in columns_cache:
+                        columns_cache[keys] = self.map_columns(server, tab_name, keys)
+                    columns = columns_cache[keys]
+                    if not identity_insert and identity_columns & set(columns):
+                        # 导入自增列的值需要打开IDENTITY_INSERT
+                        cur.execute(f'SET IDENTITY_INSERT {server.escape_value(tab_name)} ON')
+                        identity_insert = True
+                    self._insert_rows(cur, server, tab_name, columns, rows)
+                    conn.commit()
+                    success_num += len(rows)
+                except DbException:
+                    raise
+                except Exception as e:
+                    conn.rollback()
+                    fail_num += len(rows)
+                    self.printer.print_error_msg(f'rows {success_num + fail_num - len(rows) + 1}-'
+                                                 f'{success_num + fail_num}, ERROR MESSAGE:{e}')
+                progress.update(read_bytes(), success_num + fail_num)
+            if identity_insert:
+                cur.execute(f'SET IDENTITY_INSERT {server.escape_value(tab_name)} OFF')
+        finally:
+            cur.close()
+            conn.close()
+        return success_num, fail_num
+
+    def import_mongo(self, server, tab_name, docs, progress, read_bytes):
+        """
+            导入到MongoDB，每批使用无序的insert_many
+        """
+        conn = server.get_connection()
+        try:
+            return insert_mongo_docs(conn[server.db_conf.database][tab_name], docs, self.printer, progress,
+                                     read_bytes)
+        finally:
+            conn.close()
+
+    def exe(self):
+        tab_name, path = self.params['option_val'], self.params['import_file']
+        file_format = get_import_format(path)
+        if not tab_name or file_format is None:
+            self.printer.print_error_msg(f'Invalid Param : "{path}", only csv, tsv, ndjson and json files are supported!')
+            self.write_error_history(f'{tab_name} {path}')
+            return
+        if not os.path.exists(path):
+            self.printer.print_error_msg(f"path:{path} not exist!")
+            self.write_error_history(f'{tab_name} {path}')
+            return
+        try:
+            server = self.get_server()
+            with InputStream(path, newline='') as data_input:
+                progress = LoadProgress(self.printer, data_input.total_bytes, 'rows')
+                docs = self._read_docs(data_input.text, file_format)
+                if server.db_conf.server_type is DatabaseType.MONGO:
+                    success_num, fail_num = self.import_mongo(server, tab_name, docs, progress, data_input.tell)
+                else:
+                    success_num, fail_num = self.import_sql(server, tab_name, docs, progress, data_input.tell)
+            seconds = progress.seconds
+            self.printer.print_info_msg(f'end import. {success_num} rows imported, {fail_num} failed, '
+                                        f'{round(seconds, 3)}s, '
+                                        f'{round((success_num + fail_num) / seconds) if seconds else 0} rows/s.')
+            self.write_ok_history(f'{tab_name} {path}')
+        except Exception as be:
+            self.printer.print_error_msg(be)
+            self.write_error_history(f'{tab_name} {path}')
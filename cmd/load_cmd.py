@@ -1,7 +1,144 @@
+import json
 import os
+import queue
+import re
+import sys
+import threading
+import time
 
+import core.print_utils as pu
+from cmd.export_cmd import MANIFEST_FILE
+from cmd.print_cmd import get_tab_name_from_sql
 from cmd.sql_cmd import SqlCmd
-from core.core import Query, DatabaseType
+from core.core import Query, DatabaseType, DbException, ServerFactory
+from core.input_utils import InputStream, STDIN_PATH, COMPRESSED_EXT_SET
+from core.sql_splitter import get_sql_splitter, split_insert
+
+# 连续的相同表和列的INSERT语句最多合并成一条语句的条数
+LOAD_BATCH_STATEMENTS = 1000
+# MongoDB每次insert_many的文档数
+INSERT_MANY_BATCH = 1000
+# MongoDB导出文件的后缀对应的格式
+MONGO_LOAD_FORMATS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'json'}
+# 打印导入进度的间隔(秒)
+PROGRESS_INTERVAL = 5
+# 并行导入时每个连接等待执行的批数
+LOAD_QUEUE_SIZE = 16
+# 并行导入时语句的执行方式: 按表分区, 所有连接都执行, 等待所有连接执行完后单独执行, 忽略
+ROUTE_TABLE, ROUTE_SESSION, ROUTE_BARRIER, ROUTE_SKIP = 'table', 'session', 'barrier', 'skip'
+_IDENTITY_INSERT_RE = re.compile(r'set\s+identity_insert\s+(\S+)\s+(on|off)$', re.I)
+_TABLE_KEYS_RE = re.compile(r'alter\s+table\s+(\S+)\s+(disable|enable)\s+keys\b', re.I)
+# 单表的DDL，第二组匹配到逗号时是DROP TABLE a, b这样的多表语句
+_TABLE_DDL_RE = re.compile(r'(?:create|alter|drop|truncate)\s+(?:temporary\s+)?table\s+(?:if\s+(?:not\s+)?exists\s+)?'
+                           r'([^\s(,;]+)\s*(,)?', re.I)
+_REFERENCES_RE = re.compile(r'\breferences\b', re.I)
+# mysqldump把语句写在/*!版本号 ... */中
+_WHITESPACE_RE = re.compile(r'\s*')
+_VERSION_COMMENT_RE = re.compile(r'/\*!\d*\s*')
+_SESSION_RE = re.compile(r'(set|use)\s', re.I)
+_DML_RE = re.compile(r'(insert|replace|update|delete)\s', re.I)
+_TABLE_LOCK_RE = re.compile(r'(lock|unlock)\s+tables?\b', re.I)
+_COMMIT = 'commit'
+
+
+def get_load_route(sql):
+    """
+        返回(执行方式, 表名)，DML、单表的CREATE/ALTER/DROP/TRUNCATE TABLE、IDENTITY_INSERT和DISABLE/ENABLE KEYS
+        按表分区，SET和USE在所有连接上执行，LOCK TABLES只对单个连接有效，并行时忽略，
+        多表和带外键的DDL等其他语句作为屏障
+    """
+    version_comment = _VERSION_COMMENT_RE.match(sql)
+    if version_comment:
+        sql = sql[version_comment.end():]
+    table_re = _IDENTITY_INSERT_RE.match(sql) or _TABLE_KEYS_RE.match(sql)
+    if table_re is None:
+        # 外键引用其他表，要等其他表的语句都执行完
+        table_re = _TABLE_DDL_RE.match(sql)
+        if table_re and (table_re.group(2) or _REFERENCES_RE.search(sql, table_re.end())):
+            return ROUTE_BARRIER, None
+    if table_re:
+        tab_name = table_re.group(1).split('.')[-1]
+        return ROUTE_TABLE, tab_name.replace('[', '').replace(']', '').replace('`', '').lower()
+    if _SESSION_RE.match(sql):
+        return ROUTE_SESSION, None
+    if _TABLE_LOCK_RE.match(sql):
+        return ROUTE_SKIP, None
+    tab_name = get_tab_name_from_sql(sql) if _DML_RE.match(sql) else None
+    return (ROUTE_TABLE, tab_name.lower()) if tab_name else (ROUTE_BARRIER, None)
+
+
+class LoadProgress:
+    """
+        根据已经读取的文件字节数计算导入速度和剩余时间，每隔interval秒打印一次进度，unit是计数的单位，
+        total_bytes为None(标准输入)时不计算进度百分比和剩余时间
+    """
+
+    def __init__(self, printer, total_bytes, unit='statements', interval=PROGRESS_INTERVAL):
+        self.__printer = printer
+        self.__total_bytes = total_bytes
+        self.__unit = unit
+        self.__interval = interval
+        self.__start = self.__last = time.time()
+
+    @property
+    def seconds(self):
+        return time.time() - self.__start
+
+    def update(self, read_bytes, count):
+        now = time.time()
+        if now - self.__last < self.__interval:
+            return
+        self.__last, seconds = now, now - self.__start
+        bytes_per_second = read_bytes / seconds if seconds else 0
+        msg = f'loaded {round(read_bytes / 1048576, 2)}MB'
+        if self.__total_bytes is not None:
+            percent = read_bytes * 100 / self.__total_bytes if self.__total_bytes else 100
+            msg += f' ({round(percent, 1)}%)'
+        msg += f', {count} {self.__unit}, {round(count / seconds)} {self.__unit}/s, ' \
+               f'{round(bytes_per_second / 1048576, 2)}MB/s'
+        if self.__total_bytes is not None:
+            eta = (self.__total_bytes - read_bytes) / bytes_per_second if bytes_per_second else 0
+            msg += f', ETA {round(max(eta, 0))}s'
+        self.__printer.print_info_msg(msg)
+
+
+def split_mongo_file_name(path):
+    """
+        返回(去掉后缀的文件名, 小写的后缀)，压缩文件先去掉压缩后缀
+    """
+    name, ext = os.path.splitext(os.path.basename(path))
+    if ext.lower() in COMPRESSED_EXT_SET:
+        name, ext = os.path.splitext(name)
+    return name, ext.lower()
+
+
+def insert_mongo_docs(collection, docs, printer, progress, read_bytes):
+    """
+        每批使用无序的insert_many导入文档，一个文档失败不影响同一批的其他文档，返回(成功条数, 失败条数)
+    """
+    from pymongo.errors import BulkWriteError
+    success_num, fail_num, batch = 0, 0, []
+
+    def _insert():
+        try:
+            return len(collection.insert_many(batch, ordered=False).inserted_ids), 0
+        except BulkWriteError as bwe:
+            inserted = bwe.details.get('nInserted', 0)
+            errors = bwe.details.get('writeErrors', [])
+            if errors:
+                printer.print_error_msg(f"{len(errors)} documents failed, ERROR MESSAGE:{errors[0]['errmsg']}")
+            return inserted, len(batch) - inserted
+
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= INSERT_MANY_BATCH:
+            success, fail = _insert()
+            success_num, fail_num, batch = success_num + success, fail_num + fail, []
+            progress.update(read_bytes(), success_num + fail_num)
+    if batch:
+        success, fail = _insert()
+        success_num, fail_num = success_num + success, fail_num + fail
+    return success_num, fail_num
 
 
 class LoadCmd(SqlCmd):
@@ -29,46 +166,249 @@ class LoadCmd(SqlCmd):
             self.printer.print_error_msg(f"SQL:{_query.sql}, ERROR MESSAGE:{be}")
             return 0, 1
 
+    def _batches(self, statements, server_type):
+        """
+            把连续的相同表和列的INSERT语句合并成一条多行INSERT，返回(VALUES之前的部分, 行列表, 原语句列表)，
+            不能合并的语句单独返回
+        """
+        max_bytes, head, rows, sqls, size = self.params['insert_max_bytes'], None, [], [], 0
+        for sql in statements:
+            insert = split_insert(sql, server_type)
+            row_bytes = 0 if insert is None else \
+                (len(insert[1]) if insert[1].isascii() else len(insert[1].encode('UTF-8'))) + 1
+            if sqls and (insert is None or insert[0] != head or len(sqls) >= LOAD_BATCH_STATEMENTS or
+                         size + row_bytes > max_bytes):
+                yield head, rows, sqls
+                head, rows, sqls, size = None, [], [], 0
+            if insert is None:
+                yield None, None, [sql]
+                continue
+            if not sqls:
+                head, size = insert[0], len(insert[0])
+            rows.append(insert[1])
+            sqls.append(sql)
+            size += row_bytes
+        if sqls:
+            yield head, rows, sqls
+
+    def exe_batch(self, cur, server_type, head, rows, sqls):
+        """
+            执行合并后的INSERT语句，执行失败时逐条重新执行，返回(成功条数, 失败条数)
+        """
+        if len(sqls) > 1:
+            try:
+                cur.execute(f"{head}{','.join(rows)}")
+                return len(sqls), 0
+            except Exception:
+                # 出错的语句需要单独执行才能知道是哪一条
+                pass
+        success_num, fail_num = 0, 0
+        for sql in sqls:
+            success, fail = self.exe_sql(cur, Query(server_type, None, sql, fold=False))
+            success_num += success
+            fail_num += fail
+        return success_num, fail_num
+
+    def serial_load(self, server, batches, progress, read_bytes):
+        """
+            在一个连接上按顺序执行，每执行commit_size条语句提交一次，返回(成功条数, 失败条数)
+        """
+        dc, commit_size = server.db_conf, self.params['load_commit_size']
+        conn = server.get_connection()
+        cur, success_num, fail_num, uncommitted = conn.cursor(), 0, 0, 0
+        try:
+            for head, rows, sqls in batches:
+                success, fail = self.exe_batch(cur, dc.server_type, head, rows, sqls)
+                success_num += success
+                fail_num += fail
+                uncommitted += success
+                if 0 < commit_size <= uncommitted:
+                    # 每执行commit_size条语句提交一次，避免一个事务过大
+                    conn.commit()
+                    uncommitted = 0
+                progress.update(read_bytes(), success_num + fail_num)
+            if uncommitted > 0:
+                conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+        return success_num, fail_num
+
+    def _load_worker(self, server, conn, tasks, counts):
+        """
+            执行一个分区的语句，任务是(批, 是否计数)，收到_COMMIT时提交，收到None时提交并退出
+        """
+        dc, commit_size = server.db_conf, self.params['load_commit_size']
+        # 每个线程使用自己的printer，错误信息直接输出
+        printer = pu.MsgPrinter(normal_out=sys.stdout, msg_out=sys.stdout, error_out=sys.stderr)
+        if not self.params['color']:
+            printer.disable_info_color()
+            printer.disable_warn_color()
+        worker_cmd = LoadCmd(self.opt, **{**self.params, 'printer': printer})
+        # uncommitted是未提交的语句数，pending是其中计数的语句数
+        cur, uncommitted, pending, stop = conn.cursor(), 0, 0, False
+        while not stop:
+            task = tasks.get()
+            # 提交或者执行失败时也要退出，否则主线程会一直等待这个线程结束
+            stop = task is None
+            try:
+                if stop or task == _COMMIT or 0 < commit_size <= uncommitted:
+                    committed, uncommitted, pending = pending, 0, 0
+                    try:
+                        conn.commit()
+                    except Exception as e:
+                        # 提交失败时事务中的语句都没有生效，计为失败
+                        counts[0] -= committed
+                        counts[1] += committed
+                        printer.print_error_msg(f'commit failed, {committed} statements rolled back, '
+                                                f'ERROR MESSAGE:{e}')
+                if task is not None and task != _COMMIT:
+                    batch, counted = task
+                    success, fail = worker_cmd.exe_batch(cur, dc.server_type, *batch)
+                    if counted:
+                        counts[0] += success
+                        counts[1] += fail
+                        pending += success
+                    uncommitted += success
+            except Exception as e:
+                printer.print_error_msg(e)
+            finally:
+                tasks.task_done()
+        cur.close()
+        printer.flush()
+
+    def parallel_load(self, server, batches, progress, read_bytes):
+        """
+            按表把语句分到多个连接上并行执行，同一张表的语句在同一个连接上按顺序执行，
+            USE和多表的DDL等不能分区的语句要等所有连接执行完并提交后在主连接上执行，返回(成功条数, 失败条数)
+        """
+        dc, workers = server.db_conf, self.params['workers']
+        servers = [ServerFactory.get_server(dc) for _ in range(workers)]
+        conns = [s.get_connection() for s in servers]
+        main_conn = server.get_connection()
+        main_cur, main_counts = main_conn.cursor(), [0, 0]
+        task_queues = [queue.Queue(maxsize=LOAD_QUEUE_SIZE) for _ in range(workers)]
+        counts, partitions = [[0, 0] for _ in range(workers)], {}
+        threads = [threading.Thread(target=self._load_worker, args=(servers[i], conns[i], task_queues[i], counts[i]),
+                                    daemon=True) for i in range(workers)]
+        for t in threads:
+            t.start()
+
+        def _barrier():
+            for q in task_queues:
+                q.put(_COMMIT)
+            for q in task_queues:
+                q.join()
+
+        def _exe_main(task):
+            success, fail = self.exe_batch(main_cur, dc.server_type, *task)
+            main_counts[0] += success
+            main_counts[1] += fail
+            main_conn.commit()
+
+        try:
+            for task in batches:
+                route, tab_name = get_load_route(task[2][0])
+                if route == ROUTE_TABLE:
+                    if tab_name not in partitions:
+                        partitions[tab_name] = len(partitions) % workers
+                    task_queues[partitions[tab_name]].put((task, True))
+                elif route == ROUTE_SESSION:
+                    # 会话变量在主连接和所有分区的连接上都设置，只按主连接计数
+                    _exe_main(task)
+                    for q in task_queues:
+                        q.put((task, False))
+                elif route == ROUTE_BARRIER:
+                    _barrier()
+                    _exe_main(task)
+                progress.update(read_bytes(), sum(c[0] + c[1] for c in counts) + sum(main_counts))
+        finally:
+            for q in task_queues:
+                q.put(None)
+            for t in threads:
+                t.join()
+            for c in conns + [main_conn]:
+                c.close()
+        return sum(c[0] for c in counts) + main_counts[0], sum(c[1] for c in counts) + main_counts[1]
+
+    def get_mongo_files(self, path):
+        """
+            返回[(集合名, 文件, 格式)]，path是export导出的目录时按manifest.json导入每个集合，
+            是文件时导入到和文件名(去掉后缀)相同的集合
+        """
+        if os.path.isdir(path):
+            with open(os.path.join(path, MANIFEST_FILE), mode='r', encoding='UTF-8') as manifest:
+                files = [(t['table'], os.path.join(path, t['file'])) for t in json.load(manifest)['tables']]
+        else:
+            files = [(split_mongo_file_name(path)[0], path)]
+        res = []
+        for tab_name, file_path in files:
+            file_format = MONGO_LOAD_FORMATS.get(split_mongo_file_name(file_path)[1])
+            if file_format is None:
+                raise DbException(f'Invalid Param : "{file_path}", only ndjson, jsonl and json files are supported!')
+            res.append((tab_name, file_path, file_format))
+        return res
+
+    def _read_mongo_docs(self, f, file_format):
+        """
+            读取export导出的扩展JSON，ndjson每行一个文档，json是连续的多个缩进的文档
+        """
+        from bson import json_util
+        if file_format == 'ndjson':
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+            return
+        decoder, text = json.JSONDecoder(object_pairs_hook=json_util.object_pairs_hook), f.read()
+        pos = _WHITESPACE_RE.match(text).end()
+        while pos < len(text):
+            doc, pos = decoder.raw_decode(text, pos)
+            pos = _WHITESPACE_RE.match(text, pos).end()
+            yield doc
+
+    def load_mongo(self, server, path):
+        """
+            用insert_many把export导出的集合重新导入MongoDB，返回(成功文档数, 失败文档数)
+        """
+        files, conn, success_num, fail_num = self.get_mongo_files(path), server.get_connection(), 0, 0
+        try:
+            for tab_name, file_path, file_format in files:
+                with InputStream(file_path) as data_input:
+                    progress = LoadProgress(self.printer, data_input.total_bytes, 'documents')
+                    success, fail = insert_mongo_docs(conn[server.db_conf.database][tab_name],
+                                                      self._read_mongo_docs(data_input.text, file_format),
+                                                      self.printer, progress, data_input.tell)
+                if len(files) > 1:
+                    self.printer.print_info_msg(f'{tab_name}: {success} documents loaded, {fail} failed.')
+                success_num, fail_num = success_num + success, fail_num + fail
+        finally:
+            conn.close()
+        return success_num, fail_num
+
     def exe(self):
         path = self.params['option_val']
-        success_num, fail_num = 0, 0
         try:
-            if os.path.exists(path):
+            if path == STDIN_PATH or os.path.exists(path):
                 server = self.get_server()
                 dc = server.db_conf
                 if dc.server_type is DatabaseType.MONGO:
-                    self.printer.print_error_msg("Not Support MongoDB!")
-                    self.write_error_history('Not Support MongoDB')
-                    return
-                conn = server.get_connection()
-                cur = conn.cursor()
-                with open(path, mode='r', encoding='UTF8') as sql_file:
-                    sql = ''
-                    for line in sql_file.readlines():
-                        t_sql = line.strip()
-                        if not t_sql or t_sql.startswith('--'):
-                            continue
-                        elif t_sql.lower().startswith(('insert', 'create', 'update', 'select', 'delete', 'alter', 'set',
-                                                       'drop', 'go', 'use', 'if', 'with', 'show', 'desc', 'grant',
-                                                       'exec')):
-                            if sql == '':
-                                sql = line
-                                continue
-                            success, fail = self.exe_sql(cur, Query(dc.server_type, None, sql, fold=False))
-                            success_num += success
-                            fail_num += fail
-                            sql = line
-                        else:
-                            sql += line
-                    if sql != '':
-                        success, fail = self.exe_sql(cur, Query(dc.server_type, None, sql, fold=False))
-                        success_num += success
-                        fail_num += fail
-                if success_num > 0:
-                    conn.commit()
-                cur.close()
-                conn.close()
-                self.printer.print_info_msg(f'end load. {success_num} successfully executed, {fail_num} failed.')
+                    start, unit = time.time(), 'documents'
+                    success_num, fail_num = self.load_mongo(server, path)
+                    seconds = time.time() - start
+                else:
+                    self.limit_insert_bytes(server)
+                    with InputStream(path) as sql_input:
+                        # 按块读取文件逐条执行，不把整个文件读到内存中，压缩文件边读边解压
+                        progress = LoadProgress(self.printer, sql_input.total_bytes)
+                        batches = self._batches(get_sql_splitter(dc.server_type).split(sql_input.text),
+                                                dc.server_type)
+                        load = self.parallel_load if (self.params['workers'] or 1) > 1 else self.serial_load
+                        success_num, fail_num = load(server, batches, progress, sql_input.tell)
+                    seconds, unit = progress.seconds, 'statements'
+                self.printer.print_info_msg(f'end load. {success_num} successfully executed, {fail_num} failed, '
+                                            f'{round(seconds, 3)}s, '
+                                            f'{round((success_num + fail_num) / seconds) if seconds else 0} '
+                                            f'{unit}/s.')
                 self.write_ok_history(path)
             else:
                 self.printer.print_error_msg(f"path:{path} not exist!")
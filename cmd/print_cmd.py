@@ -1,9 +1,16 @@
 import abc
 import re
 from datetime import datetime, timedelta
+from itertools import chain, islice
 
 import core.print_utils as pu
 from cmd.cmd import Cmd
+from core.core import DatabaseType
+
+# pymysql中数字和时间类型的type_code，这些列的值不会是bytes
+MYSQL_NOT_BYTES_TYPES = {0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12, 13, 14, 246}
+# pymssql的type_code: STRING=1, BINARY=2, NUMBER=3, DATETIME=4, DECIMAL=5
+MSSQL_BINARY_TYPE, MSSQL_NUMBER_TYPE = 2, 3
 
 
 def get_tab_name_from_sql(src_sql):
@@ -14,13 +21,15 @@ def get_tab_name_from_sql(src_sql):
     def deal_tab_name(tab_name):
         if '.' in tab_name:
             tab_name = tab_name.split('.')[-1]
-        tab_name = tab_name.replace('[', '').replace(']', '')
+        tab_name = tab_name.replace('[', '').replace(']', '').replace('`', '')
         b_index = sql.index(tab_name)
         return src_sql[b_index:b_index + len(tab_name)]
 
     sql = src_sql.strip().lower()
     if sql.startswith(('select', 'delete')) and 'from' in sql:
         return deal_tab_name(re.split('\\s+', sql[sql.index('from') + 4:].strip())[0])
+    elif sql.startswith(('insert', 'replace')) and 'into' in sql:
+        return deal_tab_name(re.split('[\\s(]+', sql[sql.index('into') + 4:].strip())[0])
     elif sql.startswith('update'):
         return deal_tab_name(re.split('\\s+', sql[sql.index('update') + 6:].strip())[0])
     elif sql.startswith(('create', 'alter',)) or (sql.startswith('drop') and re.split('\\s+', sql)[1] == 'table'):
@@ -31,16 +40,34 @@ def get_tab_name_from_sql(src_sql):
         return None
 
 
-def deal_res(res):
-    for row in res:
-        for cdx, e in enumerate(row):
-            if isinstance(e, (bytearray, bytes)):
-                try:
-                    row[cdx] = str(e, 'utf8')
-                except Exception:
-                    row[cdx] = pu.HexObj(e.hex())
-            elif isinstance(e, bool):
-                row[cdx] = 1 if e else 0
+def deal_bytes(e):
+    if isinstance(e, (bytearray, bytes)):
+        try:
+            return str(e, 'utf8')
+        except Exception:
+            return pu.HexObj(e.hex())
+    return e
+
+
+def deal_bool(e):
+    return (1 if e else 0) if isinstance(e, bool) else e
+
+
+def deal_value(e):
+    return deal_bool(deal_bytes(e))
+
+
+def get_value_func(server_type, type_code):
+    """
+        根据列的类型选择需要的转换函数，返回None表示不需要转换
+    """
+    if type_code is None:
+        return deal_value
+    if server_type is DatabaseType.MYSQL:
+        return None if type_code in MYSQL_NOT_BYTES_TYPES else deal_bytes
+    if server_type is DatabaseType.SQL_SERVER:
+        return deal_bytes if type_code == MSSQL_BINARY_TYPE else deal_bool if type_code == MSSQL_NUMBER_TYPE else None
+    return deal_value
 
 
 class PrintCmd(Cmd):
@@ -69,55 +96,104 @@ class PrintCmd(Cmd):
     def fold(self):
         return self.params['fold']
 
-    def deal_human(self, rows):
-        def can_human(field_name):
-            return 'time' in field_name
-
-        human_time_cols = set(i for i in range(len(rows[0])) if can_human(str(rows[0][i]).lower()))
-        for rdx, row in enumerate(rows):
-            if rdx == 0:
-                continue
-            for cdx, ele in enumerate(row):
-                if cdx in human_time_cols and isinstance(ele, int):
-                    # 注意：时间戳被当成毫秒级时间戳处理，秒级时间戳格式化完是错误的时间
-                    rows[rdx][cdx] = (datetime(1970, 1, 1) + timedelta(milliseconds=ele)).strftime("%Y-%m-%d %H:%M:%S")
-        return rows
-
-    def before_print(self, header, res, query):
+    def deal_human(self, e):
+        if isinstance(e, int):
+            # 注意：时间戳被当成毫秒级时间戳处理，秒级时间戳格式化完是错误的时间
+            return (datetime(1970, 1, 1) + timedelta(milliseconds=e)).strftime("%Y-%m-%d %H:%M:%S")
+        return e
+
+    def compile_row_converter(self, header, query, description=None):
+        """
+            根据cursor.description中的类型和查询参数，为每一列生成一次转换函数，
+            之后每行数据只需要调用一次返回的函数就能完成列选择、类型转换、human和折叠处理
+        """
+        fold_limit = self.params['fold_limit']
+        fold_str, end_pos = self.params['print_conf'].fold_replace_str_with_color, fold_limit - 3
+
+        def _fold(e):
+            s = str(e)
+            return e if len(s) < fold_limit else f'{s[:end_pos]}{fold_str}'
+
+        def _compose(funcs):
+            funcs = [f for f in funcs if f]
+            if len(funcs) < 2:
+                return funcs[0] if funcs else None
+
+            def _composed(e):
+                for f in funcs:
+                    e = f(e)
+                return e
+
+            return _composed
+
+        # [(列下标, 转换函数)]，不需要转换的列函数为None
+        columns = []
+        for cdx in query.columns if query.columns else range(len(header)):
+            type_code = description[cdx][1] if description and len(description[cdx]) > 1 else None
+            columns.append((cdx, _compose([get_value_func(query.server_type, type_code),
+                                           self.deal_human if query.human and 'time' in str(header[cdx]).lower()
+                                           else None,
+                                           _fold if query.fold else None])))
+        if not query.columns and all(func is None for _, func in columns):
+            return list
+
+        def _convert(row):
+            return [row[cdx] if func is None else func(row[cdx]) for cdx, func in columns]
+
+        return _convert
+
+    def before_print(self, header, res, query, description=None):
         """
             需要注意不能改变原本数据的类型，除了需要替换成其它数据的情况
+            res不是list时(例如游标迭代器)，返回的结果也是迭代器，逐行处理而不会一次性读取全部数据
         """
         if res is None:
-            return []
+            return header, []
+        lazy = not isinstance(res, list)
         if query.limit_rows:
-            res = res[query.limit_rows[0]:query.limit_rows[1]]
-        res = [row if isinstance(row, list) else list(row) for row in res]
-        res.insert(0, header if isinstance(header, list) else list(header))
-        res = [[line[i] for i in query.columns] for line in res] if query.columns else res
-        deal_res(res)
-        res = self.deal_human(res) if query.human else res
+            if lazy and min(query.limit_rows) >= 0:
+                res = islice(res, query.limit_rows[0], query.limit_rows[1])
+            else:
+                # 负数下标只能在客户端读完全部数据后切片
+                res, lazy = (list(res) if lazy else res)[query.limit_rows[0]:query.limit_rows[1]], False
+        header = header if isinstance(header, list) else list(header)
+        convert = self.compile_row_converter(header, query, description)
+        header = [header[i] for i in query.columns] if query.columns else header
         fold_limit = self.params['fold_limit']
         fold_str, end_pos = self.params['print_conf'].fold_replace_str_with_color, fold_limit - 3
-        res = [[e if len(str(e)) < fold_limit else
-                f'{str(e)[:end_pos]}{fold_str}' for e in row] for row in res] if query.fold else res
-        return res.pop(0), res
+        header = [e if len(str(e)) < fold_limit else f'{str(e)[:end_pos]}{fold_str}' for e in header] \
+            if query.fold else header
+        return header, map(convert, res) if lazy else [convert(row) for row in res]
+
+    def _print_table(self, header, res, *funcs):
+        pc, mp = self.params['print_conf'], self.printer
+        if isinstance(res, list):
+            pu.print_table(header, res, pc, mp, *funcs)
+        else:
+            pu.print_table_stream(header, res, pc, mp, self.params['stream_sample_rows'], None, *funcs)
 
-    def print_result_set(self, header, res, query, res_index=0):
+    def print_result_set(self, header, res, query, res_index=0, description=None):
         if not header:
             return
 
         mp, pc, out_format = self.printer, self.params['print_conf'], self.out_format
+        if res is not None and not isinstance(res, list):
+            first_row = next(iter(res), None)
+            res = [] if first_row is None else chain((first_row,), res)
         if not res and out_format == 'table':
             mp.print_warn_msg('Empty Sets!')
             return
-        header, res = self.before_print(header, res, query)
+        header, res = self.before_print(header, res, query, description)
         if out_format == 'table':
-            pu.print_table(header, res, pc, mp, lambda t, p: p.print_info_msg(f'Result Sets [{res_index}]:'))
+            self._print_table(header, res, lambda t, p: p.print_info_msg(f'Result Sets [{res_index}]:'))
         elif out_format == 'sql' and query and query.server_type and query.sql:
             pu.print_insert_sql(header, res, query.table_name if query.table_name else get_tab_name_from_sql(query.sql),
-                                query.server_type, mp)
+                                query.server_type, mp, self.params['insert_batch_rows'],
+                                self.params['insert_max_bytes'])
         elif out_format == 'json':
             pu.print_json(header, res, mp)
+        elif out_format in {'ndjson', 'jsonl'}:
+            pu.print_ndjson(header, res, mp)
         elif out_format == 'html':
             pu.print_html(header, res, mp)
         elif out_format == 'html2':
@@ -127,13 +203,14 @@ class PrintCmd(Cmd):
         elif out_format == 'html4':
             pu.print_html4(header, res, mp)
         elif out_format == 'markdown':
-            pu.print_markdown(header, res, pc, mp)
+            pu.print_markdown(header, list(res), pc, mp)
         elif out_format == 'xml':
             pu.print_xml(header, res, mp)
-        elif out_format == 'csv':
-            pu.print_csv(header, res, mp)
+        elif out_format in {'csv', 'tsv'}:
+            pu.print_csv(header, res, mp, '\t' if out_format == 'tsv' else self.params['csv_delimiter'],
+                         self.params['csv_quoting'])
         elif out_format == 'text':
-            pu.print_table(header, res, pc, mp, lambda a, b: a, lambda a, b, c, d, e, f: a, lambda a, b, c: a)
+            self._print_table(header, res, lambda a, b: a, lambda a, b, c, d, e, f: a, lambda a, b, c: a)
         else:
             mp.print_error_msg(f'Invalid Out Format : "{out_format}"!')
 
@@ -4,13 +4,18 @@ from core.core import Query
 
 class ScanCmd(SqlCmd):
     name = 'scan'
+    stream_fetch = True
 
     def exe(self):
         server = self.get_server()
         tab_name = self.params['option_val']
-        sql = server.get_scan_table_sql(tab_name)
         dc, conn = server.db_conf, server.get_connection()
+        select_columns, columns = self.push_down_columns(server, tab_name)
+        fold_limit = self.truncate_limit
+        table_columns = server.get_table_columns(tab_name) if fold_limit else None
+        sql, limit_rows = self.push_down_limit(
+            server, server.get_scan_table_sql(tab_name, select_columns, table_columns, fold_limit))
         self._run_sql(
-            Query(dc.server_type, dc.database, sql, tab_name, self.fold, self.columns, self.limit_rows, self.human),
+            Query(dc.server_type, dc.database, sql, tab_name, self.fold, columns, limit_rows, self.human),
             conn)
         conn.close()
@@ -17,6 +17,7 @@ class ShellCmd(SqlCmd):
         while val not in {'quit', '!q', 'exit'}:
             if not (val == '' or val.strip() == ''):
                 self._run_sql(Query(dc.server_type, None, val), conn)
+            self.printer.flush()
             val = input('db>')
         conn.close()
         self.printer.output('Bye')
@@ -1,5 +1,6 @@
 from cmd.sql_cmd import SqlCmd
 from core.core import DatabaseType, Query
+from core.mongo_query import MongoQuery
 
 
 class ShowCmd(SqlCmd):
@@ -26,8 +27,8 @@ class ShowCmd(SqlCmd):
             return
         conn = server.get_connection()
         if dc.server_type is DatabaseType.MONGO:
-            db = conn[dc.database]
-            header, res = eval(sql)
+            header = ['Database'] if show_obj in {'database', 'databases'} else ['Collection']
+            res = [[name] for name in sorted(MongoQuery.parse(sql).execute(conn, dc.database))]
             self.print_result_set(header, res, Query(dc.server_type, dc.database, sql, None, False))
         else:
             self._run_sql(Query(dc.server_type, dc.database, sql, fold=False), conn)
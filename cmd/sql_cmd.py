@@ -1,12 +1,30 @@
+import re
 import sys
-from collections import Iterable
+from collections.abc import Iterable
+from itertools import chain, islice
 
 from cmd.conf_cmd import ConfCmd
+from core import pool
 from core.core import DatabaseType, Query, DatabaseConf, ServerFactory
+from core.mongo_query import MongoQuery
+
+
+# Mongo结果集中表头之外的字段保存在这一列
+MONGO_OVERFLOW_COLUMN = '$extra'
+# 修改会话变量的语句
+_SET_SESSION_RE = re.compile(r'(^|;)\s*set\s', re.I)
 
 
 class SqlCmd(ConfCmd):
     name = 'sql'
+    # 是否默认使用流式读取结果集
+    stream_fetch = False
+    # 用户输入的sql
+    origin_sql = None
+
+    @property
+    def stream(self):
+        return self.stream_fetch or self.params['stream']
 
     def check_conf(self, db_conf: dict):
         if db_conf['use']['conf'] == ConfCmd.DEFAULT_CONF:
@@ -28,40 +46,85 @@ class SqlCmd(ConfCmd):
             sys.exit(-1)
         dc = DatabaseConf(info['conf'][info['use']['env']].get(info['use']['conf'], {}))
         try:
-            return ServerFactory.get_server(dc)
+            server = ServerFactory.get_server(dc)
+            if self.out_format == 'sql' and self.params['insert_batch_rows'] > 1:
+                self.limit_insert_bytes(server)
+            return server
         except BaseException as e:
             self.printer.print_error_msg(e)
             self.write_error_history("Can't Create Server")
             sys.exit(-1)
 
+    def limit_insert_bytes(self, server):
+        """
+            多行INSERT语句的大小不能超过服务端允许的最大语句长度，预留1KB给协议头等开销
+        """
+        max_statement_bytes = server.get_max_statement_bytes()
+        if max_statement_bytes:
+            self.params['insert_max_bytes'] = min(self.params['insert_max_bytes'], max_statement_bytes - 1024)
+
+    def _flatten_doc(self, doc, prefix=''):
+        """
+            把嵌套的文档展开成"a.b"形式的字段，数组保持原样
+        """
+        flat = {}
+        for k, v in doc.items():
+            if isinstance(v, dict) and v:
+                flat.update(self._flatten_doc(v, f'{prefix}{k}.'))
+            else:
+                flat[f'{prefix}{k}'] = v
+        return flat
+
+    def _infer_mongo_schema(self, docs):
+        """
+            用前stream_sample_rows个文档的字段作为表头，之后的文档逐个转换成行，不再缓存全部文档，
+            还有更多文档时增加MONGO_OVERFLOW_COLUMN列，保存表头中没有的字段。
+            表头在读到后面的文档之前就要输出，所以只要还有更多文档就固定增加这一列，没有新字段的行是None
+        """
+        flatten, end = self.params['flatten'], object()
+        docs = map(lambda d: self._flatten_doc(d) if isinstance(d, dict) else d, docs) if flatten else docs
+        sample, header, value_type = list(islice(docs, self.params['stream_sample_rows'])), {}, None
+        for d in sample:
+            if isinstance(d, dict):
+                header.update(dict.fromkeys(d.keys()))
+            elif value_type is None:
+                value_type = type(d).__name__
+        next_doc = next(docs, end)
+        overflow, keys = next_doc is not end, list(header)
+        header_list = keys + ([f'result({value_type})'] if value_type else []) + \
+            ([MONGO_OVERFLOW_COLUMN] if overflow else [])
+
+        def _row(d):
+            if not isinstance(d, dict):
+                row = [None] * len(keys)
+                if value_type:
+                    return row + [d, None] if overflow else row + [d]
+                return row + [d]
+            row = [d.get(k) for k in keys] + ([None] if value_type else [])
+            if overflow:
+                extra_keys = d.keys() - header.keys()
+                row.append({k: d[k] for k in d if k in extra_keys} if extra_keys else None)
+            return row
+
+        if not overflow:
+            return header_list, [_row(d) for d in sample]
+        return header_list, map(_row, chain(sample, (next_doc,), docs))
+
     def _deal_mongo_result(self, mongo_result):
         if mongo_result is None:
             return None, None
-        header_list, result_list = [], []
         if isinstance(mongo_result, dict):
-            result_list.append([])
-            for (k, value) in mongo_result.items():
-                header_list.append(k)
-                result_list[0].append(value)
-        elif isinstance(mongo_result, Iterable) and not isinstance(mongo_result, str):
-            t_set, result_dict_list = set(), []
-            for d in mongo_result:
-                if isinstance(d, dict):
-                    result_dict_list.append(d)
-                    for (k, value) in d.items():
-                        if k not in t_set:
-                            t_set.add(k)
-                            header_list.append(k)
-                else:
-                    result_list.append([d])
-            if result_list:
-                header_list.append(f"result({type(result_list[0][0]).__name__})")
-            for d in result_dict_list:
-                result_list.append([d.get(h, None) for h in header_list])
-        else:
-            header_list.append(f'result({type(mongo_result).__name__})')
-            result_list.append([mongo_result])
-        return header_list, result_list
+            doc = self._flatten_doc(mongo_result) if self.params['flatten'] else mongo_result
+            return list(doc.keys()), [list(doc.values())]
+        if isinstance(mongo_result, Iterable) and not isinstance(mongo_result, (str, bytes)):
+            return self._infer_mongo_schema(iter(mongo_result))
+        return [f'result({type(mongo_result).__name__})'], [[mongo_result]]
+
+    def _history_sql(self, sql):
+        """
+            sql命令的历史记录保存用户输入的sql，而不是下推row[a:b]后改写的sql
+        """
+        return self.origin_sql or sql
 
     def _get_table_head_from_description(self, description):
         return [desc[0] for desc in description] if description else []
@@ -69,14 +132,14 @@ class SqlCmd(ConfCmd):
     def exe_mongo(self, conn, query):
         if conn is None:
             return
-        db = conn[query.database]
         try:
-            res = eval(query.sql)
+            res = MongoQuery.parse(query.sql).execute(conn, query.database,
+                                                      self.params['fetch_size'] if self.stream else None)
             header_list, result_list = self._deal_mongo_result(res)
             self.print_result_set(header_list, result_list, query)
-            self.write_ok_history(query.sql)
+            self.write_ok_history(self._history_sql(query.sql))
         except Exception as e:
-            self.write_error_history(query.sql)
+            self.write_error_history(self._history_sql(query.sql))
             self.printer.print_error_msg(e)
 
     def _exe_query(self, sql, conn):
@@ -89,12 +152,62 @@ class SqlCmd(ConfCmd):
             while cur.nextset():
                 description.append(cur.description)
                 res_list.append(cur.fetchall())
-            self.write_ok_history(sql)
+            self.write_ok_history(self._history_sql(sql))
         except BaseException as be:
-            self.write_error_history(sql)
+            self.write_error_history(self._history_sql(sql))
             self.printer.print_error_msg(be)
         return description, res_list
 
+    def _get_cursor(self, conn, server_type, stream=False):
+        if stream and server_type is DatabaseType.MYSQL:
+            # 非缓冲游标，数据按需从服务端读取
+            import pymysql.cursors
+            return conn.cursor(pymysql.cursors.SSCursor)
+        return conn.cursor()
+
+    def _fetch_iter(self, cur):
+        fetch_size = self.params['fetch_size']
+        rows = cur.fetchmany(fetch_size)
+        while rows:
+            yield from rows
+            rows = cur.fetchmany(fetch_size)
+
+    def _exe_stream(self, query, conn, is_query=True):
+        """
+            流式执行sql，每个结果集按fetch_size分批读取，边读边打印
+        """
+        sql, effect_rows = query.sql.strip(), None
+        try:
+            if not is_query and sql.lower().startswith(('create', 'drop')):
+                conn.autocommit(True)
+            cur = self._get_cursor(conn, query.server_type, True)
+            # 非缓冲游标execute返回的不是实际的行数，查询语句不输出影响行数
+            effect_rows, res_index = cur.execute(sql), 0
+            if is_query:
+                effect_rows = None
+            while True:
+                if cur.description:
+                    rows = self._fetch_iter(cur)
+                    self.print_result_set(self._get_table_head_from_description(cur.description), rows, query,
+                                          res_index, cur.description)
+                    self.printer.output('\n', end='')
+                    # 结果集没有读完时需要先读完才能切换到下一个结果集
+                    for _ in rows:
+                        pass
+                    res_index += 1
+                elif not is_query and not effect_rows and self.out_format == 'table':
+                    self.printer.print_warn_msg('Empty Sets!')
+                if not cur.nextset():
+                    break
+            cur.close()
+            if not is_query:
+                conn.commit()
+            self.write_ok_history(self._history_sql(sql))
+        except BaseException as be:
+            self.write_error_history(self._history_sql(sql))
+            self.printer.print_error_msg(be)
+        return effect_rows
+
     def _exe_no_query(self, sql, conn):
         effect_rows, description, res, success = None, [], [], False
         try:
@@ -113,9 +226,9 @@ class SqlCmd(ConfCmd):
                 if not effect_rows and self.out_format == 'table':
                     self.printer.print_warn_msg('Empty Sets!')
             success = True
-            self.write_ok_history(sql)
+            self.write_ok_history(self._history_sql(sql))
         except BaseException as be:
-            self.write_error_history(sql)
+            self.write_error_history(self._history_sql(sql))
             self.printer.print_error_msg(be)
         return effect_rows, description, res, success
 
@@ -124,20 +237,58 @@ class SqlCmd(ConfCmd):
         if query.server_type is DatabaseType.MONGO:
             self.exe_mongo(conn, query)
             return
-        if sql.lower().startswith(('select', 'show')):
+        if isinstance(conn, pool.PooledConnection) and _SET_SESSION_RE.search(sql):
+            # SET修改的会话变量在归还连接时不能恢复，这个连接不再复用
+            conn.discard()
+        if self.stream:
+            effect_rows = self._exe_stream(query, conn, sql.lower().startswith(('select', 'show')))
+        elif sql.lower().startswith(('select', 'show')):
             description, res = self._exe_query(sql, conn)
         else:
             effect_rows, description, res, success = self._exe_no_query(sql, conn)
         if description and res:
             for index, (d, r) in enumerate(zip(description, res)):
-                self.print_result_set(self._get_table_head_from_description(d), r, query, index)
+                self.print_result_set(self._get_table_head_from_description(d), r, query, index, d)
                 self.printer.output('\n', end='')
         if effect_rows and self.out_format == 'table':
             self.printer.print_info_msg(f'Effect Rows:{effect_rows}')
 
+    def push_down_limit(self, server, sql):
+        """
+            row[a:b]能下推到查询语句时返回改写后的sql，客户端不再切片
+        """
+        limit_sql = server.get_limit_sql(sql, self.limit_rows)
+        return (sql, self.limit_rows) if limit_sql is None else (limit_sql, None)
+
+    @property
+    def truncate_limit(self):
+        """
+            服务端截断字段的长度，只有指定truncate并且以表格形式折叠打印时才生效
+        """
+        return self.params['fold_limit'] \
+            if self.params['truncate'] and self.fold and self.out_format in {'table', 'text'} else None
+
+    def push_down_columns(self, server, tab_name):
+        """
+            根据表的列信息把col[...]下推到查询语句中，返回(需要查询的列名, 客户端还需要选择的列下标)
+        """
+        if not self.columns or server.db_conf.server_type is DatabaseType.MONGO and self.params['flatten']:
+            # 展开后的列和文档的顶层字段不是一一对应的，在客户端选择
+            return None, self.columns
+        table_columns = server.get_table_columns(tab_name)
+        if max(self.columns) >= len(table_columns):
+            return None, self.columns
+        if server.db_conf.server_type is DatabaseType.MONGO:
+            # 投影后字段的顺序仍然是文档中的顺序，客户端需要重新选择一次
+            ordinals = sorted(set(self.columns))
+            return [table_columns[i][0] for i in ordinals], [ordinals.index(i) for i in self.columns]
+        return [table_columns[i][0] for i in self.columns], None
+
     def exe(self):
         server = self.get_server()
         dc, conn = server.db_conf, server.get_connection()
-        self._run_sql(Query(dc.server_type, dc.database, self.params['option_val'], None,
-                            self.fold, self.columns, self.limit_rows, self.human), conn)
+        self.origin_sql = self.params['option_val'].strip()
+        sql, limit_rows = self.push_down_limit(server, self.params['option_val'])
+        self._run_sql(Query(dc.server_type, dc.database, sql, None,
+                            self.fold, self.columns, limit_rows, self.human), conn)
         conn.close()
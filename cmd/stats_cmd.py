@@ -0,0 +1,37 @@
+from cmd.count_cmd import CountCmd
+from core.core import DatabaseType, Query
+from core.mongo_query import MongoQuery
+
+STATS_HEADER = ['table_name', 'row_count', 'data_bytes', 'index_bytes', 'total_bytes', 'free_bytes', 'fragmentation']
+
+
+class StatsCmd(CountCmd):
+    name = 'stats'
+
+    def _coll_stats_row(self, tab_name, stats):
+        """
+            collStats的结果转换成和关系数据库相同的列，数据大小使用磁盘上(压缩后)的storageSize
+        """
+        storage_size, index_size = stats.get('storageSize', 0), stats.get('totalIndexSize', 0)
+        free_size = stats.get('freeStorageSize', 0)
+        return [tab_name, stats.get('count', 0), storage_size, index_size, storage_size + index_size, free_size,
+                round(free_size * 100 / storage_size, 2) if storage_size else None]
+
+    def exe(self):
+        server = self.get_server()
+        dc, conn = server.db_conf, server.get_connection()
+        try:
+            if dc.server_type is DatabaseType.MONGO:
+                res = [self._coll_stats_row(t, MongoQuery.parse(server.get_table_stats_sql(dc.database, t))
+                                            .execute(conn, dc.database)) for t in self.list_tables(server, conn)]
+                res.sort(key=lambda row: (-row[4], row[0]))
+                self.print_result_set(list(STATS_HEADER), res, Query(dc.server_type, dc.database, None, None, False))
+                self.write_ok_history('stats')
+            else:
+                sql = server.get_table_stats_sql(dc.database)
+                self._run_sql(Query(dc.server_type, dc.database, sql, None, False), conn)
+        except Exception as e:
+            self.write_error_history('stats')
+            self.printer.print_error_msg(e)
+        finally:
+            conn.close()
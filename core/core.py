@@ -1,6 +1,32 @@
 import abc
+import re
+from decimal import Decimal
 from enum import Enum
 
+from core import pool
+
+# 字符串、带引号的标识符、括号和其他内容
+_SQL_PART_RE = re.compile(r"'(?:[^']|'')*'|\[(?:[^\]]|\]\])*\]|\"(?:[^\"]|\"\")*\"|[()]|[^'\[\"()]+|.")
+
+
+def _top_level_sql(sql):
+    """
+        去掉字符串、带引号的标识符和括号中的内容，只保留最外层的sql，例如子查询和OVER(...)中的ORDER BY会被去掉
+    """
+    parts, depth = [], 0
+    for m in _SQL_PART_RE.finditer(sql):
+        part = m.group()
+        if part == '(':
+            depth += 1
+        elif part == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0 and part[0] not in {"'", '[', '"'}:
+            parts.append(part)
+        else:
+            continue
+        parts.append(' ')
+    return ''.join(parts)
+
 
 class DatabaseType(Enum):
     SQL_SERVER = 'sqlserver'
@@ -179,13 +205,19 @@ class DatabaseConf:
     def conn(self):
         return self.__connection
 
+    @property
+    def key(self):
+        return (self.__server_type.value, self.__host, self.__port, self.__database, self.__user, self.__password,
+                self.__charset, self.__autocommit)
+
 
 class Server:
-    __slots__ = ('_db_conf', '_connection')
+    __slots__ = ('_db_conf', '_connection', '_table_columns')
 
     def __init__(self, db_conf):
         self._db_conf = db_conf
         self._connection = None
+        self._table_columns = {}
 
     @property
     def db_conf(self):
@@ -194,11 +226,111 @@ class Server:
     def get_count_table_sql(self, tab_name):
         return f'SELECT COUNT(*) row_count FROM {self.escape_value(tab_name)}'
 
-    def get_peek_table_sql(self, tab_name):
-        return f'SELECT * FROM {self.escape_value(tab_name)} LIMIT 1'
+    def get_estimated_count_sql(self, database, tab_name=None):
+        """
+            从统计信息中读取估算的行数，不扫描表，tab_name为None时返回所有表
+        """
+        tab_filter = '' if tab_name is None else f' AND TABLE_NAME={self.key_literal(tab_name)}'
+        return f"SELECT TABLE_NAME table_name,TABLE_ROWS row_count FROM information_schema.TABLES " \
+               f"WHERE TABLE_SCHEMA='{database}' AND TABLE_TYPE='BASE TABLE'{tab_filter} ORDER BY TABLE_NAME"
+
+    def get_table_stats_sql(self, database, tab_name=None):
+        """
+            一条目录查询返回所有表的行数估算、数据和索引占用的字节数、空闲字节数和碎片率(空闲空间的百分比)，
+            按占用空间从大到小排列
+        """
+        return f"SELECT TABLE_NAME table_name,TABLE_ROWS row_count,DATA_LENGTH data_bytes,INDEX_LENGTH index_bytes," \
+               f"DATA_LENGTH+INDEX_LENGTH total_bytes,DATA_FREE free_bytes," \
+               f"ROUND(DATA_FREE*100/NULLIF(DATA_LENGTH+INDEX_LENGTH+DATA_FREE,0),2) fragmentation " \
+               f"FROM information_schema.TABLES WHERE TABLE_SCHEMA='{database}' AND TABLE_TYPE='BASE TABLE' " \
+               f"ORDER BY total_bytes DESC,TABLE_NAME"
+
+    def get_peek_table_sql(self, tab_name, columns=None, table_columns=None, fold_limit=None):
+        return f'SELECT {self._select_columns_sql(columns, table_columns, fold_limit)} ' \
+               f'FROM {self.escape_value(tab_name)} LIMIT 1'
+
+    def get_scan_table_sql(self, tab_name, columns=None, table_columns=None, fold_limit=None):
+        """
+            columns为空时查询全部列，fold_limit不为空时table_columns中的字符串和二进制列在服务端截断
+        """
+        return f"SELECT {self._select_columns_sql(columns, table_columns, fold_limit)} " \
+               f"FROM {self.escape_value(tab_name)}"
+
+    def _select_columns_sql(self, columns, table_columns=None, fold_limit=None):
+        if not fold_limit or not table_columns:
+            return ','.join(map(self.escape_value, columns)) if columns else '*'
+        column_types = dict(table_columns)
+        return ','.join(self._truncate_column_sql(c, fold_limit) if self._can_truncate(column_types.get(c)) else
+                        self.escape_value(c) for c in (columns if columns else column_types.keys()))
+
+    def _can_truncate(self, data_type):
+        return str(data_type).lower() in {'char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'json',
+                                          'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob'}
+
+    def _truncate_column_sql(self, column, fold_limit):
+        return f'LEFT({self.escape_value(column)},{fold_limit}) {self.escape_value(column)}'
+
+    def get_table_columns(self, tab_name):
+        """
+            返回表的[(列名, 类型)]，按列的顺序排列，结果会被缓存
+        """
+        if tab_name not in self._table_columns:
+            cur = self.get_connection().cursor()
+            cur.execute(self.get_table_columns_sql(self.db_conf.database, tab_name))
+            self._table_columns[tab_name] = [(row[0], row[1]) for row in cur.fetchall()]
+            cur.close()
+        return self._table_columns[tab_name]
+
+    def get_table_columns_sql(self, database, tab_name):
+        return f"SELECT COLUMN_NAME,DATA_TYPE FROM information_schema.columns WHERE TABLE_SCHEMA='{database}' " \
+               f"AND TABLE_NAME='{tab_name}' ORDER BY ORDINAL_POSITION"
+
+    def get_max_statement_bytes(self):
+        """
+            服务端允许的单条语句的最大字节数，没有限制时返回None
+        """
+        return None
+
+    def get_limit_sql(self, sql, limit_rows):
+        """
+            把row[a:b]下推到查询语句中，只处理简单的SELECT语句，不能下推时返回None
+        """
+        if not limit_rows or not 0 <= limit_rows[0] < limit_rows[1] or not self._is_simple_select(sql):
+            return None
+        return self._limit_sql(sql.strip().rstrip(';').rstrip(), limit_rows[0], limit_rows[1] - limit_rows[0])
+
+    def _is_simple_select(self, sql):
+        lower_sql = sql.strip().rstrip(';').lower()
+        return lower_sql.startswith('select') and ';' not in lower_sql and \
+               not re.search(r'--|#|/\*|\b(limit|top|offset|fetch|union|into|for\s+update)\b', lower_sql)
 
-    def get_scan_table_sql(self, tab_name):
-        return f"SELECT * FROM {self.escape_value(tab_name)}"
+    def _limit_sql(self, sql, offset, count):
+        return None
+
+    def can_keyset(self, data_type):
+        """
+            能用来按主键分块读取的列类型
+        """
+        return str(data_type).lower() in {'tinyint', 'smallint', 'mediumint', 'int', 'bigint', 'decimal', 'char',
+                                          'varchar', 'date', 'datetime', 'timestamp'}
+
+    def get_keyset_sql(self, tab_name, key_column, last_key_literal, chunk_size):
+        """
+            按主键顺序读取主键大于last_key_literal的chunk_size行，last_key_literal为None时从第一行开始
+        """
+        return f'SELECT * FROM {self.escape_value(tab_name)}{self._keyset_where_sql(key_column, last_key_literal)} ' \
+               f'ORDER BY {self.escape_value(key_column)} LIMIT {chunk_size}'
+
+    def _keyset_where_sql(self, key_column, last_key_literal):
+        return '' if last_key_literal is None else f' WHERE {self.escape_value(key_column)}>{last_key_literal}'
+
+    def key_literal(self, value):
+        """
+            把主键值转换成sql中的字面量
+        """
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return str(value)
+        return "'{}'".format(str(value).replace("'", "''"))
 
     @abc.abstractmethod
     def escape_value(self, value):
@@ -216,13 +348,72 @@ class Server:
     def get_list_views_sql(self, database):
         pass
 
-    @abc.abstractmethod
     def get_connection(self):
+        if self._connection is None:
+            self._connection = self.connect() if pool.POOL_MANAGER is None else pool.POOL_MANAGER.acquire(self)
+        return self._connection
+
+    def release_connection(self):
+        """
+            关闭(守护进程中归还到连接池)缓存的连接，之后get_connection重新获取连接
+        """
+        if self._connection is not None:
+            conn, self._connection = self._connection, None
+            conn.close()
+
+    @abc.abstractmethod
+    def connect(self):
         pass
 
+    def check_connection(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchall()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    def reset_connection(self, conn):
+        """
+            连接归还到连接池之前回滚未提交的事务，恢复autocommit和配置的数据库(命令中可能执行了USE)，
+            返回连接是否还能复用
+        """
+        try:
+            conn.rollback()
+            conn.autocommit(self.db_conf.autocommit)
+            cur = conn.cursor()
+            cur.execute(f'USE {self.escape_value(self.db_conf.database)}')
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    def close_connection(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 
 class MySQLServer(Server):
 
+    def _limit_sql(self, sql, offset, count):
+        return f'{sql} LIMIT {offset},{count}'
+
+    def get_max_statement_bytes(self):
+        cur = self.get_connection().cursor()
+        cur.execute('SELECT @@max_allowed_packet')
+        max_allowed_packet = cur.fetchall()[0][0]
+        cur.close()
+        return int(max_allowed_packet)
+
+    def key_literal(self, value):
+        if isinstance(value, str):
+            return "'{}'".format(value.replace('\\', '\\\\').replace("'", "''"))
+        return super().key_literal(value)
+
     def escape_value(self, value):
         return f'`{value}`'
 
@@ -235,20 +426,81 @@ class MySQLServer(Server):
     def get_list_views_sql(self, database):
         return f"SELECT DISTINCT TABLE_NAME `View` FROM information_schema.views WHERE TABLE_SCHEMA='{database}' ORDER BY `View`"
 
-    def get_connection(self):
-        if self._connection is None:
-            import pymysql
-            self._connection = pymysql.connect(host=self.db_conf.host, user=self.db_conf.user,
-                                               password=self.db_conf.password, database=self.db_conf.database,
-                                               port=self.db_conf.port, charset=self.db_conf.charset,
-                                               autocommit=self.db_conf.autocommit)
-        return self._connection
+    def connect(self):
+        import pymysql
+        return pymysql.connect(host=self.db_conf.host, user=self.db_conf.user,
+                               password=self.db_conf.password, database=self.db_conf.database,
+                               port=self.db_conf.port, charset=self.db_conf.charset,
+                               autocommit=self.db_conf.autocommit)
+
+    def check_connection(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
 
 
 class SQLServer(Server):
 
-    def get_peek_table_sql(self, tab_name):
-        return f'SELECT TOP 1 * FROM {self.escape_value(tab_name)}'
+    def get_peek_table_sql(self, tab_name, columns=None, table_columns=None, fold_limit=None):
+        return f'SELECT TOP 1 {self._select_columns_sql(columns, table_columns, fold_limit)} ' \
+               f'FROM {self.escape_value(tab_name)}'
+
+    def get_estimated_count_sql(self, database, tab_name=None):
+        # 堆(index_id=0)或聚集索引(index_id=1)各分区的行数之和
+        tab_filter = '' if tab_name is None else f' WHERE t.name={self.key_literal(tab_name)}'
+        return f"SELECT t.name table_name,SUM(p.row_count) row_count FROM sys.tables t " \
+               f"JOIN sys.dm_db_partition_stats p ON p.object_id=t.object_id AND p.index_id IN (0,1)" \
+               f"{tab_filter} GROUP BY t.object_id,t.name ORDER BY t.name"
+
+    def get_table_stats_sql(self, database, tab_name=None):
+        # 堆和聚集索引的页是数据，其余已使用的页是索引，保留未使用的页作为空闲空间，每页8KB
+        data_pages = "SUM(CASE WHEN p.index_id IN (0,1) THEN p.in_row_data_page_count+p.lob_used_page_count+" \
+                     "p.row_overflow_used_page_count ELSE 0 END)"
+        return f"SELECT t.name table_name,SUM(CASE WHEN p.index_id IN (0,1) THEN p.row_count ELSE 0 END) row_count," \
+               f"{data_pages}*8192 data_bytes,(SUM(p.used_page_count)-{data_pages})*8192 index_bytes," \
+               f"SUM(p.used_page_count)*8192 total_bytes,SUM(p.reserved_page_count-p.used_page_count)*8192 free_bytes," \
+               f"CAST(SUM(p.reserved_page_count-p.used_page_count)*100.0/NULLIF(SUM(p.reserved_page_count),0) " \
+               f"AS DECIMAL(5,2)) fragmentation FROM sys.tables t " \
+               f"JOIN sys.dm_db_partition_stats p ON p.object_id=t.object_id " \
+               f"GROUP BY t.object_id,t.name ORDER BY total_bytes DESC,t.name"
+
+    def _can_truncate(self, data_type):
+        return str(data_type).lower() in {'char', 'varchar', 'nchar', 'nvarchar', 'text', 'ntext',
+                                          'binary', 'varbinary', 'image'}
+
+    def _truncate_column_sql(self, column, fold_limit):
+        # LEFT不支持text/ntext/image类型
+        return f'SUBSTRING({self.escape_value(column)},1,{fold_limit}) {self.escape_value(column)}'
+
+    def get_table_columns_sql(self, database, tab_name):
+        return f"SELECT COLUMN_NAME,DATA_TYPE FROM information_schema.columns WHERE TABLE_CATALOG='{database}' " \
+               f"AND TABLE_NAME='{tab_name}' ORDER BY ORDINAL_POSITION"
+
+    def _limit_sql(self, sql, offset, count):
+        select_re = re.match(r'^select(\s+distinct)?\s', sql, re.I)
+        if offset == 0:
+            return f'{sql[:select_re.end()]}TOP {count} {sql[select_re.end():]}'
+        if select_re.group(1):
+            # DISTINCT不能使用ORDER BY (SELECT NULL)
+            return None
+        # 只有最外层的ORDER BY能和OFFSET一起使用
+        order_by = '' if re.search(r'\border\s+by\b', _top_level_sql(sql), re.I) else ' ORDER BY (SELECT NULL)'
+        return f'{sql}{order_by} OFFSET {offset} ROWS FETCH NEXT {count} ROWS ONLY'
+
+    def can_keyset(self, data_type):
+        return str(data_type).lower() in {'tinyint', 'smallint', 'int', 'bigint', 'decimal', 'numeric', 'char',
+                                          'varchar', 'nchar', 'nvarchar', 'date', 'datetime2'}
+
+    def get_keyset_sql(self, tab_name, key_column, last_key_literal, chunk_size):
+        return f'SELECT TOP {chunk_size} * FROM {self.escape_value(tab_name)}' \
+               f'{self._keyset_where_sql(key_column, last_key_literal)} ORDER BY {self.escape_value(key_column)}'
+
+    def key_literal(self, value):
+        if isinstance(value, str):
+            return "N'{}'".format(value.replace("'", "''"))
+        return super().key_literal(value)
 
     def escape_value(self, value):
         return f'[{value}]'
@@ -262,44 +514,108 @@ class SQLServer(Server):
     def get_list_views_sql(self, database):
         return f"SELECT DISTINCT TABLE_NAME [View] FROM information_schema.views WHERE TABLE_CATALOG='{database}' ORDER BY TABLE_NAME"
 
-    def get_connection(self):
-        if self._connection is None:
-            import pymssql
-            self._connection = pymssql.connect(host=self.db_conf.host, user=self.db_conf.user,
-                                               password=self.db_conf.password, database=self.db_conf.database,
-                                               port=self.db_conf.port, charset=self.db_conf.charset,
-                                               autocommit=self.db_conf.autocommit)
-        return self._connection
+    def connect(self):
+        import pymssql
+        return pymssql.connect(host=self.db_conf.host, user=self.db_conf.user,
+                               password=self.db_conf.password, database=self.db_conf.database,
+                               port=self.db_conf.port, charset=self.db_conf.charset,
+                               autocommit=self.db_conf.autocommit)
 
 
 class MongoDBServer(Server):
 
     def get_count_table_sql(self, tab_name):
-        return f"db.{self.escape_value(tab_name)}.count()"
-
-    def get_peek_table_sql(self, tab_name):
-        return f'db.{self.escape_value(tab_name)}.find_one()'
-
-    def get_scan_table_sql(self, tab_name):
-        return f'db.{self.escape_value(tab_name)}.find()'
+        from core.mongo_query import MongoQuery
+        return str(MongoQuery(tab_name, 'count_documents', [{}]))
+
+    def get_estimated_count_sql(self, database, tab_name=None):
+        # 集合的元数据中记录的文档数，只能逐个集合读取
+        from core.mongo_query import MongoQuery
+        if tab_name is None:
+            raise DbException("Collection Name Is Required!")
+        return str(MongoQuery(tab_name, 'estimated_document_count'))
+
+    def get_table_stats_sql(self, database, tab_name=None):
+        # collStats只能逐个集合执行
+        from core.mongo_query import MongoQuery
+        if tab_name is None:
+            raise DbException("Collection Name Is Required!")
+        return str(MongoQuery(None, 'command', ['collStats', tab_name]))
+
+    def get_peek_table_sql(self, tab_name, columns=None, table_columns=None, fold_limit=None):
+        from core.mongo_query import MongoQuery
+        if fold_limit and table_columns:
+            return self._limit_sql(self.get_scan_table_sql(tab_name, columns, table_columns, fold_limit), 0, 1)
+        return str(MongoQuery(tab_name, 'find_one', self._projection_args(columns)))
+
+    def get_scan_table_sql(self, tab_name, columns=None, table_columns=None, fold_limit=None):
+        from core.mongo_query import MongoQuery
+        if fold_limit and table_columns:
+            pipeline = self._truncate_pipeline(columns, table_columns, fold_limit)
+            return str(MongoQuery(tab_name, 'aggregate', [pipeline]))
+        return str(MongoQuery(tab_name, 'find', self._projection_args(columns)))
+
+    def _projection(self, columns):
+        projection = {c: 1 for c in columns}
+        if '_id' not in projection:
+            projection['_id'] = 0
+        return projection
+
+    def _projection_args(self, columns):
+        return [{}, self._projection(columns)] if columns else []
+
+    def _truncate_pipeline(self, columns, table_columns, fold_limit):
+        pipeline = [{'$project': self._projection(columns)}] if columns else []
+        str_fields = [c for c, t in table_columns if t == 'str' and (not columns or c in columns)]
+        if str_fields:
+            # 只截断字符串类型的字段，其它字段保持原样
+            pipeline.append({'$addFields': {f: {'$cond': [{'$eq': [{'$type': f'${f}'}, 'string']},
+                                                          {'$substrCP': [f'${f}', 0, fold_limit]}, f'${f}']}
+                                            for f in str_fields}})
+        return pipeline
+
+    def get_table_columns(self, tab_name):
+        """
+            集合没有固定的结构，以第一个文档的字段作为集合的列
+        """
+        if tab_name not in self._table_columns:
+            doc = self.get_connection()[self.db_conf.database][tab_name].find_one() or {}
+            self._table_columns[tab_name] = [(k, type(v).__name__) for k, v in doc.items()]
+        return self._table_columns[tab_name]
+
+    def _is_simple_select(self, sql):
+        from core.mongo_query import MongoQuery
+        try:
+            return MongoQuery.parse(sql).is_simple_select()
+        except DbException:
+            return False
+
+    def _limit_sql(self, sql, offset, count):
+        from core.mongo_query import MongoQuery
+        return str(MongoQuery.parse(sql).with_limit(offset, count))
 
     def escape_value(self, value):
         return f'{value}'
 
     def get_list_databases_sql(self):
-        return "['Database'], [[c] for c in sorted(conn.list_database_names())]"
+        return 'db.list_database_names()'
 
     def get_list_tables_sql(self, database):
-        return "['Collection'], [[c] for c in sorted(db.list_collection_names())]"
+        return 'db.list_collection_names()'
 
     def get_list_views_sql(self, database):
         raise DbException("Not Support MongoDB!")
 
-    def get_connection(self):
-        if self._connection is None:
-            import pymongo
-            self._connection = pymongo.MongoClient(host=self.db_conf.host)
-        return self._connection
+    def connect(self):
+        import pymongo
+        return pymongo.MongoClient(host=self.db_conf.host)
+
+    def check_connection(self, conn):
+        # MongoClient会自动重连
+        return True
+
+    def reset_connection(self, conn):
+        return True
 
 
 class ServerFactory:
@@ -0,0 +1,83 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+
+__all__ = ['InputStream', 'STDIN_PATH', 'COMPRESSED_EXT_SET']
+
+# 从标准输入读取
+STDIN_PATH = '-'
+COMPRESSED_EXT_SET = {'.gz', '.bz2', '.xz'}
+# 读取文件的缓冲区大小(字节)
+READ_BUFFER_SIZE = 1024 * 1024
+# 压缩格式的魔数
+_MAGIC_OPENERS = [
+    (b'\x1f\x8b', lambda f: gzip.GzipFile(fileobj=f, mode='rb')),
+    (b'BZh', bz2.BZ2File),
+    (b'\xfd7zXZ\x00', lzma.LZMAFile),
+]
+
+
+class _CountingReader(io.RawIOBase):
+    """
+        记录从文件或标准输入中读取的字节数，压缩文件读取的是压缩后的字节数
+    """
+
+    def __init__(self, raw, close_raw=True):
+        self.__raw = raw
+        self.__close_raw = close_raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.__raw.readinto(b)
+        self.bytes_read += n or 0
+        return n
+
+    def close(self):
+        if self.__close_raw:
+            self.__raw.close()
+        super().close()
+
+
+class InputStream:
+    """
+        以文本流的方式读取文件或者标准输入(path为-)，按文件开头的魔数自动解压gzip、bz2和xz，
+        tell返回已经读取的原始(压缩)字节数，total_bytes是文件的大小，标准输入时为None
+    """
+
+    def __init__(self, path, encoding='UTF8', newline=None):
+        if path == STDIN_PATH:
+            self.__reader, self.total_bytes = _CountingReader(sys.stdin.buffer, False), None
+        else:
+            self.__reader, self.total_bytes = _CountingReader(open(path, mode='rb', buffering=0)), \
+                os.path.getsize(path)
+        self.__buffered = buffered = io.BufferedReader(self.__reader, READ_BUFFER_SIZE)
+        head, binary = buffered.peek(6), buffered
+        for magic, opener in _MAGIC_OPENERS:
+            if head.startswith(magic):
+                binary = opener(buffered)
+                break
+        self.__text = io.TextIOWrapper(binary, encoding=encoding, newline=newline)
+
+    @property
+    def text(self):
+        return self.__text
+
+    def tell(self):
+        return self.__reader.bytes_read
+
+    def close(self):
+        # 解压的文件对象不会关闭传入的文件
+        self.__text.close()
+        self.__buffered.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
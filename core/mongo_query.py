@@ -0,0 +1,190 @@
+import ast
+import re
+from datetime import datetime
+
+from core.core import DbException
+
+__all__ = ['MongoQuery']
+
+# 集合、游标、数据库和客户端上支持的方法
+COLLECTION_METHODS = {'find', 'find_one', 'aggregate', 'count', 'count_documents', 'estimated_document_count',
+                      'distinct', 'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one',
+                      'delete_one', 'delete_many', 'create_index', 'drop_index', 'index_information', 'drop'}
+CURSOR_METHODS = {'skip', 'limit', 'sort', 'batch_size', 'hint', 'max_time_ms', 'allow_disk_use', 'collation',
+                  'comment', 'count'}
+DATABASE_METHODS = {'list_collection_names', 'command'}
+CLIENT_METHODS = {'list_database_names'}
+# mongo shell中只影响显示的方法
+IGNORED_METHODS = {'pretty', 'toArray'}
+# 聚合管道中不能再追加$skip和$limit的阶段
+_OUTPUT_STAGES = {'$out', '$merge'}
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+_NAMES = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+
+
+def _iso_date(value=None):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else datetime.now()
+
+
+def _object_id(*args):
+    from bson import ObjectId
+    return ObjectId(*args)
+
+
+_CONSTRUCTORS = {'ObjectId': _object_id, 'ISODate': _iso_date, 'datetime': datetime}
+
+
+def _literal(node):
+    """
+        把语法树节点转换成值，只支持字面量、true/false/null、ObjectId、ISODate和datetime，不执行任意代码
+    """
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Dict) and None not in node.keys:
+        # 和mongo shell一样，字段名可以不加引号
+        return {k.id if isinstance(k, ast.Name) and k.id not in _NAMES else _literal(k): _literal(v)
+                for k, v in zip(node.keys, node.values)}
+    if isinstance(node, ast.List):
+        return [_literal(e) for e in node.elts]
+    if isinstance(node, ast.Tuple):
+        return tuple(_literal(e) for e in node.elts)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)) and \
+            isinstance(node.operand, ast.Constant) and isinstance(node.operand.value, (int, float)):
+        return -node.operand.value if isinstance(node.op, ast.USub) else node.operand.value
+    if isinstance(node, ast.Name) and node.id in _NAMES:
+        return _NAMES[node.id]
+    if isinstance(node, ast.Call) and not node.keywords:
+        func = node.func.id if isinstance(node.func, ast.Name) else \
+            node.func.attr if isinstance(node.func, ast.Attribute) else None
+        if func in _CONSTRUCTORS:
+            return _CONSTRUCTORS[func](*[_literal(a) for a in node.args])
+    raise DbException(f'Unsupported Expression: {ast.unparse(node)}')
+
+
+def _render(value):
+    """
+        把值转换成能被_literal解析的文本
+    """
+    if isinstance(value, dict):
+        return f"{{{', '.join(f'{_render(k)}: {_render(v)}' for k, v in value.items())}}}"
+    if isinstance(value, list):
+        return f"[{', '.join(_render(v) for v in value)}]"
+    if isinstance(value, tuple):
+        return f"({', '.join(_render(v) for v in value)}{',' if len(value) == 1 else ''})"
+    if isinstance(value, datetime):
+        return f'ISODate({value.isoformat()!r})'
+    return repr(value)
+
+
+class MongoQuery:
+    """
+        解析db.<集合>.<方法>(...)[.<游标方法>(...)]形式的查询，参数只能是字面量，
+        执行时直接调用pymongo的方法，不使用eval
+    """
+
+    def __init__(self, collection, method, args=(), kwargs=None, modifiers=None):
+        self.collection = collection
+        self.method = method
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+        # [(方法名, 参数列表, 关键字参数)]
+        self.modifiers = modifiers or []
+
+    @staticmethod
+    def parse(text):
+        try:
+            node = ast.parse(text.strip().rstrip(';'), mode='eval').body
+        except SyntaxError as se:
+            raise DbException(f'Invalid Query: {se.msg}!')
+        calls = []
+        while isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr not in IGNORED_METHODS:
+                calls.append((node.func.attr, [_literal(a) for a in node.args],
+                              {k.arg: _literal(k.value) for k in node.keywords if k.arg}))
+            node = node.func.value
+        calls.reverse()
+        names = []
+        while isinstance(node, ast.Attribute):
+            names.append(node.attr)
+            node = node.value
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'db':
+            collection = '.'.join([str(_literal(node.slice))] + names[::-1])
+        elif isinstance(node, ast.Name) and node.id == 'db':
+            collection = '.'.join(names[::-1]) or None
+        else:
+            raise DbException('Query Must Start With "db."!')
+        if not calls:
+            raise DbException('Missing Method!')
+        (method, args, kwargs), modifiers = calls[0], calls[1:]
+        if collection is None and method not in DATABASE_METHODS | CLIENT_METHODS or \
+                collection is not None and method not in COLLECTION_METHODS:
+            raise DbException(f'Not Support Method: {method}!')
+        for name, _, _ in modifiers:
+            if method not in {'find', 'aggregate'} or name not in CURSOR_METHODS or \
+                    method == 'aggregate' and name != 'batch_size':
+                raise DbException(f'Not Support Method: {method}(...).{name}!')
+        return MongoQuery(collection, method, args, kwargs, modifiers)
+
+    def __str__(self):
+        def _call(name, args, kwargs):
+            params = [_render(a) for a in args] + [f'{k}={_render(v)}' for k, v in kwargs.items()]
+            return f".{name}({', '.join(params)})"
+
+        target = 'db' if self.collection is None else f'db.{self.collection}' \
+            if _IDENTIFIER_RE.match(self.collection) else f'db[{self.collection!r}]'
+        return target + _call(self.method, self.args, self.kwargs) + \
+            ''.join(_call(name, args, kwargs) for name, args, kwargs in self.modifiers)
+
+    @property
+    def pipeline(self):
+        return self.args[0] if self.method == 'aggregate' and self.args and isinstance(self.args[0], list) else None
+
+    def is_simple_select(self):
+        """
+            返回结果集的find和aggregate查询，并且没有指定skip和limit，可以下推row[a:b]
+        """
+        if self.method == 'find':
+            return not any(name in {'skip', 'limit', 'count'} for name, _, _ in self.modifiers)
+        pipeline = self.pipeline
+        return pipeline is not None and \
+            not any(isinstance(s, dict) and (_OUTPUT_STAGES | {'$skip', '$limit'}) & s.keys() for s in pipeline)
+
+    def with_limit(self, offset, count):
+        """
+            返回追加了skip和limit的查询，聚合在管道最后追加$skip和$limit阶段
+        """
+        if self.method == 'aggregate':
+            stages = ([{'$skip': offset}] if offset else []) + [{'$limit': count}]
+            return MongoQuery(self.collection, self.method, [self.pipeline + stages] + self.args[1:], self.kwargs,
+                              self.modifiers)
+        modifiers = ([('skip', [offset], {})] if offset else []) + [('limit', [count], {})]
+        return MongoQuery(self.collection, self.method, self.args, self.kwargs, self.modifiers + modifiers)
+
+    def execute(self, conn, database, batch_size=None):
+        """
+            在客户端conn上执行，返回游标、文档或者数值，batch_size是游标每批从服务端读取的文档数
+        """
+        if self.method in CLIENT_METHODS:
+            return getattr(conn, self.method)(*self.args, **self.kwargs)
+        db = conn[database]
+        if self.collection is None:
+            return getattr(db, self.method)(*self.args, **self.kwargs)
+        collection, args, kwargs = db[self.collection], self.args, dict(self.kwargs)
+        if self.method == 'count':
+            # pymongo 4移除了count
+            return collection.count_documents(args[0] if args else {}, **kwargs)
+        if self.method == 'aggregate':
+            if len(args) > 1 and isinstance(args[1], dict):
+                # mongo shell的写法: aggregate(pipeline, {allowDiskUse: true})
+                kwargs.update(args[1])
+                args = args[:1]
+            if batch_size:
+                kwargs.setdefault('batchSize', batch_size)
+        res = getattr(collection, self.method)(*args, **kwargs)
+        for name, m_args, m_kwargs in self.modifiers:
+            if name == 'count':
+                return collection.count_documents(args[0] if args else {})
+            res = getattr(res, name)(*m_args, **m_kwargs)
+        if batch_size and self.method == 'find':
+            res.batch_size(batch_size)
+        return res
@@ -0,0 +1,155 @@
+import threading
+import time
+
+# 守护进程中设置，为None时每次都直接创建连接
+POOL_MANAGER = None
+
+
+def limit_workers(workers):
+    """
+        守护进程中并行的每个线程都从连接池获取连接，线程数不能超过连接池的大小
+    """
+    return workers if POOL_MANAGER is None else max(1, min(workers, POOL_MANAGER.max_size))
+
+
+class PooledConnection:
+    """
+        连接池中连接的代理，close时把连接归还到连接池而不是关闭
+    """
+
+    def __init__(self, pool, server, conn):
+        self._pool = pool
+        self._server = server
+        self._conn = conn
+        self._released = False
+        self._discarded = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __getitem__(self, key):
+        return self._conn[key]
+
+    def discard(self):
+        """
+            连接上修改了不能恢复的会话状态(例如SET)，归还时关闭而不是复用
+        """
+        self._discarded = True
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._server, self._conn, self._discarded)
+
+
+class ConnectionPool:
+    def __init__(self, max_size, idle_timeout, acquire_timeout):
+        self.__max_size = max_size
+        self.__idle_timeout = idle_timeout
+        self.__acquire_timeout = acquire_timeout
+        self.__idle = []
+        self.__in_use = 0
+        self.__cond = threading.Condition()
+
+    @property
+    def idle_num(self):
+        return len(self.__idle)
+
+    @property
+    def in_use_num(self):
+        return self.__in_use
+
+    def acquire(self, server):
+        deadline = time.time() + self.__acquire_timeout
+        with self.__cond:
+            while not self.__idle and self.__in_use >= self.__max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError(f'No Idle Connection In {self.__acquire_timeout}s, '
+                                       f'All {self.__max_size} Connections Are In Use!')
+                self.__cond.wait(remaining)
+            conn = self.__idle.pop()[1] if self.__idle else None
+            self.__in_use += 1
+        try:
+            if conn is not None and not server.check_connection(conn):
+                server.close_connection(conn)
+                conn = None
+            return PooledConnection(self, server, conn if conn is not None else server.connect())
+        except BaseException:
+            with self.__cond:
+                self.__in_use -= 1
+                self.__cond.notify()
+            raise
+
+    def release(self, server, conn, discard=False):
+        reusable = not discard and server.reset_connection(conn)
+        with self.__cond:
+            self.__in_use -= 1
+            if reusable:
+                self.__idle.append((time.time(), conn))
+            self.__cond.notify()
+        if not reusable:
+            server.close_connection(conn)
+
+    def close_idle(self, server, force=False):
+        """
+            关闭空闲时间超过idle_timeout的连接
+        """
+        now = time.time()
+        with self.__cond:
+            expired = [c for t, c in self.__idle if force or now - t > self.__idle_timeout]
+            self.__idle = [(t, c) for t, c in self.__idle if not force and now - t <= self.__idle_timeout]
+        for conn in expired:
+            server.close_connection(conn)
+
+
+class PoolManager:
+    """
+        按数据库配置管理连接池，同一个配置的连接可以被多次请求复用
+    """
+
+    def __init__(self, max_size=4, idle_timeout=300, acquire_timeout=60):
+        self.__max_size = max_size
+        self.__idle_timeout = idle_timeout
+        self.__acquire_timeout = acquire_timeout
+        self.__pools = {}
+        self.__servers = {}
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    @property
+    def max_size(self):
+        return self.__max_size
+
+    def _pool(self, server):
+        key = server.db_conf.key
+        with self.__lock:
+            if key not in self.__pools:
+                self.__pools[key] = ConnectionPool(self.__max_size, self.__idle_timeout, self.__acquire_timeout)
+                self.__servers[key] = server
+            return self.__pools[key]
+
+    def acquire(self, server):
+        conn = self._pool(server).acquire(server)
+        if not hasattr(self.__local, 'connections'):
+            self.__local.connections = []
+        self.__local.connections.append(conn)
+        return conn
+
+    def release_thread_connections(self):
+        """
+            归还当前线程中没有被关闭的连接，防止命令异常退出时连接泄漏
+        """
+        for conn in getattr(self.__local, 'connections', []):
+            conn.close()
+        self.__local.connections = []
+
+    def close_idle(self, force=False):
+        with self.__lock:
+            pools = [(self.__servers[k], p) for k, p in self.__pools.items()]
+        for server, pool in pools:
+            pool.close_idle(server, force)
+
+    def stats(self):
+        with self.__lock:
+            return [[*key[:5], pool.idle_num, pool.in_use_num] for key, pool in self.__pools.items()]
@@ -1,15 +1,33 @@
+import csv
+import gzip
 import os
 import sys
 import html
 import json
+import math
+from bisect import bisect_left
+from decimal import Decimal
 from enum import Enum
+from functools import lru_cache
+from itertools import islice
 from core.core import DatabaseType
 
 __all__ = [
-    'print_table', 'print_markdown', 'print_insert_sql', 'print_json', 'print_config',
-    'print_html', 'print_html2', 'print_html3', 'print_html4', 'print_xml', 'print_csv'
+    'print_table', 'print_table_stream', 'print_markdown', 'print_insert_sql', 'print_json', 'print_ndjson',
+    'print_config',
+    'print_html', 'print_html2', 'print_html3', 'print_html4', 'print_xml', 'print_csv', 'CSV_QUOTING'
 ]
 
+# 缓存显示宽度的字符串的最大长度
+WIDTH_CACHE_TEXT_LEN = 256
+
+CSV_QUOTING = {
+    'minimal': csv.QUOTE_MINIMAL,
+    'all': csv.QUOTE_ALL,
+    'nonnumeric': csv.QUOTE_NONNUMERIC,
+    'none': csv.QUOTE_NONE
+}
+
 
 class Color(Enum):
     OFF_WHITE = "\033[29;1m{}\033[0m"
@@ -109,6 +127,10 @@ class PrintConf:
     def null_str_with_color_len(self):
         return self.__null_str_with_color_len
 
+    @property
+    def fold_replace_str(self):
+        return self.__fold_replace_str
+
     @property
     def fold_replace_str_with_color(self):
         return self.__fold_replace_str_with_color
@@ -140,23 +162,102 @@ widths = [
 
 
 class MsgPrinter:
-    def __init__(self, info_color=Color.GREEN, warn_color=Color.KHAKI, error_color=Color.RED, normal_out=sys.stdout):
+    def __init__(self, info_color=Color.GREEN, warn_color=Color.KHAKI, error_color=Color.RED, normal_out=sys.stdout,
+                 buffer_size=64 * 1024, msg_out=sys.stdout, error_out=sys.stderr):
         self.__info_color = info_color
         self.__warn_color = warn_color
         self.__error_color = error_color
         self.__normal_out = normal_out
+        self.__default_out = normal_out
+        self.__msg_out = msg_out
+        self.__error_out = error_out
+        self.__binary_out = False
+        # 输出到终端时不缓冲，保证交互时能及时看到结果
+        self.__buffer_size = 0 if normal_out.isatty() else buffer_size
+        self.__buffer = []
+        self.__buffer_len = 0
 
     def print_error_msg(self, msg, end='\n'):
-        sys.stderr.write(f'{self.__error_color.wrap(msg)}{end}')
+        self.flush()
+        self.__error_out.write(f'{self.__error_color.wrap(msg)}{end}')
 
     def print_info_msg(self, msg, end='\n'):
-        sys.stdout.write(f'{self.__info_color.wrap(msg)}{end}')
+        self.flush()
+        self.__msg_out.write(f'{self.__info_color.wrap(msg)}{end}')
 
     def print_warn_msg(self, msg, end='\n'):
-        sys.stdout.write(f'{self.__warn_color.wrap(msg)}{end}')
+        self.flush()
+        self.__msg_out.write(f'{self.__warn_color.wrap(msg)}{end}')
 
     def output(self, data, end='\n'):
-        self.__normal_out.write(f'{data}{end}')
+        self.write(f'{data}{end}')
+
+    def output_lines(self, lines, end='\n'):
+        """
+            批量输出多行数据，lines可以是list或者生成器
+        """
+        batch, batch_len = [], 0
+        for line in lines:
+            line = f'{line}{end}'
+            batch.append(line)
+            batch_len += len(line)
+            if batch_len >= self.__buffer_size:
+                self.write(''.join(batch))
+                batch, batch_len = [], 0
+        if batch:
+            self.write(''.join(batch))
+
+    def write(self, data):
+        self.__buffer.append(data)
+        self.__buffer_len += len(data)
+        if self.__buffer_len >= self.__buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.__buffer:
+            data = ''.join(self.__buffer)
+            self.__buffer, self.__buffer_len = [], 0
+            self.__normal_out.write(data.encode('UTF-8') if self.__binary_out else data)
+        self.__normal_out.flush()
+
+    def open_out(self, path, resume=False):
+        """
+            数据输出到文件，使用二进制大缓冲区写入，UTF-8编码在刷新缓冲区时批量进行，.gz结尾的文件使用gzip压缩，
+            resume为True时不清空已有的文件，由调用者通过truncate决定从哪里继续写
+        """
+        self.flush()
+        self.__buffer_size = max(self.__buffer_size, 64 * 1024)
+        if path.endswith('.gz'):
+            self.__normal_out = gzip.open(path, mode='wb', compresslevel=6)
+        else:
+            resume = resume and os.path.exists(path)
+            self.__normal_out = open(path, mode='r+b' if resume else 'wb', buffering=self.__buffer_size)
+        self.__binary_out = True
+
+    @property
+    def seekable(self):
+        return self.__binary_out and self.__normal_out.seekable() and not isinstance(self.__normal_out, gzip.GzipFile)
+
+    def tell(self):
+        """
+            刷新缓冲区并返回输出文件当前的位置
+        """
+        self.flush()
+        return self.__normal_out.tell()
+
+    def truncate(self, offset):
+        """
+            丢弃输出文件offset之后的内容，从offset开始继续写
+        """
+        self.flush()
+        self.__normal_out.seek(offset)
+        self.__normal_out.truncate()
+
+    def close(self):
+        self.flush()
+        if self.__binary_out:
+            self.__normal_out.close()
+            self.__normal_out, self.__binary_out = self.__default_out, False
 
     def disable_info_color(self):
         self.__info_color = Color.NO_COLOR
@@ -168,24 +269,35 @@ class MsgPrinter:
         self.__error_color = Color.NO_COLOR
 
 
+_width_bounds, _width_values = [num for num, _ in widths], [wid for _, wid in widths]
+
+
 def _calc_char_width(char):
     char_ord = ord(char)
     if char_ord == 0xe or char_ord == 0xf:
         return 0
-    global widths
-    for num, wid in widths:
-        if char_ord <= num:
-            return wid
-    return 1
+    index = bisect_left(_width_bounds, char_ord)
+    return _width_values[index] if index < len(_width_values) else 1
+
+
+def _text_width(text):
+    if text.isascii():
+        # ASCII字符中只有\x0e、\x0f和\x7f的宽度是0，其它都是1
+        return len(text) - text.count('\x0e') - text.count('\x0f') - text.count('\x7f')
+    # 只缓存短字符串，不折叠时的大字段直接计算，避免缓存长期占用大量内存
+    return _cached_text_width(text) if len(text) <= WIDTH_CACHE_TEXT_LEN else sum(map(_calc_char_width, text))
+
+
+@lru_cache(maxsize=16384)
+def _cached_text_width(text):
+    return sum(map(_calc_char_width, text))
 
 
 def _str_width(any_str, pc: PrintConf):
     if any_str == pc.null_str_with_color:
         return pc.null_str_with_color_len
     ln = -pc.fold_color_len if any_str.endswith(pc.fold_replace_str_with_color) else 0
-    for char in any_str:
-        ln += _calc_char_width(char)
-    return ln
+    return ln + _text_width(any_str)
 
 
 def _get_max_length_each_fields(rows, pc: PrintConf):
@@ -224,23 +336,54 @@ def _default_after_print_row(row_num, row_total_num, max_row_length, table_width
         mp.output(pc.split_row_char * table_width)
 
 
+def _deal_table_row(row, align_list, pc: PrintConf):
+    for cdx, e in enumerate(row):
+        if isinstance(e, str):
+            row[cdx] = e.replace('\r', '\\r').replace('\n', '\\n').replace('\t', '\\t') \
+                .replace('\0', '\\0').replace('\b', '\\b')
+        elif isinstance(e, (int, float)):
+            # 数字采用右对齐
+            align_list[cdx], row[cdx] = Align.ALIGN_RIGHT, str(e)
+        elif e is None:
+            row[cdx] = pc.null_str_with_color
+        else:
+            row[cdx] = str(e)
+    return row
+
+
+def _fit_width(e, max_width, pc: PrintConf):
+    """
+        把单元格截断到指定的显示宽度之内，返回(截断后的内容, 显示宽度)
+    """
+    width = _str_width(e, pc)
+    if width <= max_width:
+        return e, width
+    if e == pc.null_str_with_color:
+        # NULL不加省略符，只截断到列宽，保证表格对齐
+        return pc.null_str[:max_width], min(max_width, len(pc.null_str))
+    fold_width = len(pc.fold_replace_str)
+    if e.endswith(pc.fold_replace_str_with_color):
+        e = e[:-len(pc.fold_replace_str_with_color)]
+    # 列宽比省略符还窄时直接截断，不加省略符
+    keep_width, ln, end = max_width - fold_width if max_width >= fold_width else max_width, 0, len(e)
+    for cdx, char in enumerate(e):
+        char_width = _calc_char_width(char)
+        if ln + char_width > keep_width:
+            end = cdx
+            break
+        ln += char_width
+    if max_width < fold_width:
+        return e[:end], ln
+    return f'{e[:end]}{pc.fold_replace_str_with_color}', ln + fold_width
+
+
 def print_table(header, res, pc: PrintConf, mp: MsgPrinter,
                 start_func=lambda table_width, mp: mp.print_info_msg('Result Sets:'),
                 after_print_row_func=_default_after_print_row,
                 end_func=lambda table_width, total, mp: mp.print_info_msg(f'Total Records: {total}')):
     def _deal_res(_res, _align_list):
         for _row in _res:
-            for cdx, e in enumerate(_row):
-                if isinstance(e, str):
-                    _row[cdx] = e.replace('\r', '\\r').replace('\n', '\\n').replace('\t', '\\t') \
-                        .replace('\0', '\\0').replace('\b', '\\b')
-                elif isinstance(e, (int, float)):
-                    # 数字采用右对齐
-                    _align_list[cdx], _row[cdx] = Align.ALIGN_RIGHT, str(e)
-                elif e is None:
-                    _row[cdx] = pc.null_str_with_color
-                else:
-                    _row[cdx] = str(e)
+            _deal_table_row(_row, _align_list, pc)
         return _res, _align_list
 
     row_total_num, col_total_num = len(res), len(header)
@@ -271,6 +414,57 @@ def print_table(header, res, pc: PrintConf, mp: MsgPrinter,
     end_func(table_width, row_total_num, mp)
 
 
+def print_table_stream(header, rows, pc: PrintConf, mp: MsgPrinter, sample_size=1000, max_col_width=None,
+                       start_func=lambda table_width, mp: mp.print_info_msg('Result Sets:'),
+                       after_print_row_func=_default_after_print_row,
+                       end_func=lambda table_width, total, mp: mp.print_info_msg(f'Total Records: {total}')):
+    """
+        流式打印表格，rows可以是任意迭代器。
+        列宽只根据header和前sample_size行计算(max_col_width不为空时列宽不超过该值)，
+        之后的行边读边打印，超出列宽的内容会被截断，内存占用与结果集大小无关。
+    """
+    col_total_num, rows = len(header), iter(rows)
+    default_align = col_total_num * [Align.ALIGN_LEFT]
+    align_list = default_align.copy()
+    header = _deal_table_row(list(header), default_align.copy(), pc)
+    window = [_deal_table_row(row if isinstance(row, list) else list(row), align_list, pc)
+              for row in islice(rows, sample_size)]
+    max_length_each_fields = [_str_width(e, pc) for e in header]
+    for row in window:
+        for cdx, e in enumerate(row):
+            max_length_each_fields[cdx] = max(_str_width(e, pc), max_length_each_fields[cdx])
+    if max_col_width:
+        max_length_each_fields = [min(max_col_width, i) for i in max_length_each_fields]
+    max_row_length = sum(max_length_each_fields)
+    table_width = 1 + max_row_length + 3 * col_total_num
+    space_list_down = [(pc.split_row_char * i, i) for i in max_length_each_fields]
+
+    def _fit_row(_row):
+        return [_fit_width(e, width, pc) for e, width in zip(_row, max_length_each_fields)]
+
+    def _rows():
+        yield from window
+        # 表头已经打印，后续行不再改变对齐方式
+        tail_align = align_list.copy()
+        for _row in rows:
+            yield _deal_table_row(_row if isinstance(_row, list) else list(_row), tail_align, pc)
+
+    start_func(table_width, mp)
+    mp.output(_table_row_str(space_list_down, max_length_each_fields, default_align, Color.NO_COLOR, '+'))
+    mp.output(_table_row_str(_fit_row(header), max_length_each_fields, align_list, pc.table_head_color))
+    mp.output(_table_row_str(space_list_down, max_length_each_fields, default_align, Color.NO_COLOR, '+'))
+    row_num, row_iter = -1, _rows()
+    # 预读一行，用来判断当前行是否是最后一行
+    next_row = next(row_iter, None)
+    while next_row is not None:
+        row_num, row, next_row = row_num + 1, next_row, next(row_iter, None)
+        mp.output(_table_row_str(_fit_row(row), max_length_each_fields, align_list, pc.data_color))
+        after_print_row_func(row_num, row_num + (1 if next_row is None else 2), max_row_length, table_width, pc, mp)
+    if row_num >= 0:
+        mp.output(_table_row_str(space_list_down, max_length_each_fields, default_align, Color.NO_COLOR, '+'))
+    end_func(table_width, row_num + 1, mp)
+
+
 def _deal_html_elem(e):
     if e is None:
         return "NULL"
@@ -283,11 +477,13 @@ def print_markdown(header, res, pc, mp):
     res = [[_deal_html_elem(e) for e in row] for row in res]
     max_length_each_fields, align_list = _get_max_length_each_fields(res, pc), len(header) * [Align.ALIGN_LEFT]
     res.insert(1, map(lambda l: ('-' * l, l), max_length_each_fields))
-    for row in res:
-        mp.output(_table_row_str(row, max_length_each_fields, align_list, Color.NO_COLOR))
+    mp.output_lines(_table_row_str(row, max_length_each_fields, align_list, Color.NO_COLOR) for row in res)
 
 
-def print_insert_sql(header, res, tab_name, server_type: DatabaseType, mp):
+def print_insert_sql(header, res, tab_name, server_type: DatabaseType, mp, batch_rows=1, max_bytes=1024 * 1024):
+    """
+        batch_rows大于1时多行合并成一条INSERT语句，每条语句最多batch_rows行并且不超过max_bytes字节
+    """
     def _case_for_sql(_row):
         for cdx, e in enumerate(_row):
             if e is None:
@@ -300,20 +496,71 @@ def print_insert_sql(header, res, tab_name, server_type: DatabaseType, mp):
             else:
                 yield f"'{e}'"
 
+    def _batch_lines(_insert_prefix):
+        # 多行写到一条INSERT中，行数和语句的字节数都不超过限制
+        values, values_bytes = [], len(_insert_prefix) + 1
+        for row in res:
+            value = f"({','.join(_case_for_sql(row))})"
+            value_bytes = (len(value) if value.isascii() else len(value.encode('UTF-8'))) + 1
+            if values and (len(values) >= batch_rows or values_bytes + value_bytes > max_bytes):
+                yield f"{_insert_prefix} {','.join(values)};"
+                values, values_bytes = [], len(_insert_prefix) + 1
+            values.append(value)
+            values_bytes += value_bytes
+        if values:
+            yield f"{_insert_prefix} {','.join(values)};"
+
     if tab_name is None:
         mp.print_error_msg("Can't Get Table Name!")
         return
     if res:
         header = map(lambda x: server_type.escape_value(str(x)), header)
         insert_prefix = f"INSERT INTO {server_type.escape_value(tab_name)} ({','.join(header)}) VALUES"
-        for row in res:
-            mp.output(f"""{insert_prefix} ({','.join(_case_for_sql(row))});""")
+        if server_type is DatabaseType.SQL_SERVER:
+            # SQL Server的VALUES最多只能有1000行
+            batch_rows = min(batch_rows, 1000)
+        if batch_rows > 1:
+            mp.output_lines(_batch_lines(insert_prefix))
+        else:
+            mp.output_lines(f"""{insert_prefix} ({','.join(_case_for_sql(row))});""" for row in res)
 
 
 def print_json(header, res, mp):
-    for row in res:
-        row = map(lambda e: e if isinstance(e, (str, int, float, list, dict, bool)) or e is None else str(e), row)
-        mp.output(json.dumps({k: v for (k, v) in zip(header, row) if v}, indent=2, ensure_ascii=False))
+    def _json_lines():
+        for row in res:
+            row = map(lambda e: e if isinstance(e, (str, int, float, list, dict, bool)) or e is None else str(e), row)
+            yield json.dumps({k: v for (k, v) in zip(header, row) if v}, indent=2, ensure_ascii=False)
+
+    mp.output_lines(_json_lines())
+
+
+def print_ndjson(header, res, mp):
+    """
+        每行输出一个紧凑的JSON对象，保留数字和null等原始类型，字段名只编码一次
+    """
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str, allow_nan=False).encode
+    keys = [f'{encode(str(h))}:' for h in header]
+
+    def _finite(e):
+        # NaN和Infinity不是合法的JSON，输出为null
+        if isinstance(e, float):
+            return e if math.isfinite(e) else None
+        if isinstance(e, dict):
+            return {k: _finite(v) for k, v in e.items()}
+        if isinstance(e, (list, tuple)):
+            return [_finite(v) for v in e]
+        return e
+
+    def _encode_value(e):
+        # Decimal直接输出为数字，避免精度丢失
+        if isinstance(e, Decimal) and e.is_finite():
+            return str(e)
+        try:
+            return encode(e)
+        except ValueError:
+            return encode(_finite(e))
+
+    mp.output_lines(f"{{{','.join(k + _encode_value(e) for k, e in zip(keys, row))}}}" for row in res)
 
 
 def print_config(path, mp):
@@ -328,17 +575,16 @@ def _print_header_with_html(header, mp):
 def print_html3(header, res, mp):
     print_config('html/html1.head', mp)
     _print_header_with_html(header, mp)
-    for row in res:
-        mp.output(f"""<tr>{''.join(map(lambda e: f"<td>{_deal_html_elem(e)}</td>", row))}</tr>""")
+    mp.output_lines(f"""<tr>{''.join(map(lambda e: f"<td>{_deal_html_elem(e)}</td>", row))}</tr>""" for row in res)
     mp.output("</table>\n</body>\n</html>")
 
 
 def print_html2(header, res, mp):
     print_config('html/html2.head', mp)
     _print_header_with_html(header, mp)
-    for rdx, row in enumerate(res):
-        mp.output(
-            f"""<tr{'' if rdx % 2 == 0 else ' class="alt"'}>{''.join(map(lambda o: f"<td>{_deal_html_elem(o)}</td>", row))}</tr>""")
+    mp.output_lines(
+        f"""<tr{'' if rdx % 2 == 0 else ' class="alt"'}>{''.join(map(lambda o: f"<td>{_deal_html_elem(o)}</td>", row))}</tr>"""
+        for rdx, row in enumerate(res))
     mp.output("</table>\n</body>\n</html>")
 
 
@@ -346,8 +592,7 @@ def print_html(header, res, mp):
     print_config('html/html3.head', mp)
     _print_header_with_html(header, mp)
     s = '<tr onmouseover="this.style.backgroundColor=\'#ffff66\';"onmouseout="this.style.backgroundColor=\'#d4e3e5\';">'
-    for row in res:
-        mp.output(f"""{s}{''.join(map(lambda e: f"<td>{_deal_html_elem(e)}</td>", row))}</tr>""")
+    mp.output_lines(f"""{s}{''.join(map(lambda e: f"<td>{_deal_html_elem(e)}</td>", row))}</tr>""" for row in res)
     mp.output("</table>")
 
 
@@ -356,26 +601,23 @@ def print_html4(header, res, mp):
     mp.output(
         f"""<thead><tr>{''.join(map(lambda head: f"<th>{'' if head is None else head}</th>", header))}</tr></thead>""")
     mp.output('<tbody>')
-    for row in res:
-        mp.output(f"""<tr>{''.join(map(lambda e: f'<td>{_deal_html_elem(e)}</td>', row))}</tr>""")
+    mp.output_lines(f"""<tr>{''.join(map(lambda e: f'<td>{_deal_html_elem(e)}</td>', row))}</tr>""" for row in res)
     mp.output("</tbody>\n</table>")
 
 
 def print_xml(hd, res, mp):
     end, d = '\n', " " * 4
     record_template = f'<RECORD>{end}{{}}{end}</RECORD>'
-    for row in res:
-        mp.output(record_template.format(
-            f"""{end.join([f"{d}<{h}/>" if e is None else f"{d}<{h}>{e}</{h}>" for h, e in zip(hd, row)])}"""))
-
-
-def print_csv(header, res, mp, split_char=','):
-    res.insert(0, header)
-    for row in res:
-        new_row = []
-        for data in row:
-            print_data = "" if data is None else str(data)
-            if split_char in print_data or '\n' in print_data or '\r' in print_data:
-                print_data = '"{}"'.format(print_data.replace('"', '""'))
-            new_row.append(print_data)
-        mp.output(split_char.join(new_row))
+    mp.output_lines(record_template.format(
+        f"""{end.join([f"{d}<{h}/>" if e is None else f"{d}<{h}>{e}</{h}>" for h, e in zip(hd, row)])}""")
+                    for row in res)
+
+
+def print_csv(header, res, mp, split_char=',', quoting='minimal'):
+    """
+        使用csv模块流式输出，res可以是任意迭代器，None输出为空字符串
+    """
+    writer = csv.writer(mp, delimiter=split_char, quoting=CSV_QUOTING[quoting], lineterminator='\n',
+                        escapechar='\\' if quoting == 'none' else None)
+    writer.writerow(header)
+    writer.writerows(res)
@@ -0,0 +1,282 @@
+import re
+
+from core.core import DatabaseType
+
+# 读取sql文件时每次读取的字符数
+READ_CHUNK_SIZE = 1024 * 1024
+# GO后面的重复次数被忽略，只作为批分隔符
+_GO_RE = re.compile(r'^\s*go(?:\s+\d+)?\s*$', re.I)
+_DELIMITER_RE = re.compile(r'^\s*delimiter\s+(\S+)\s*$', re.I)
+# 存储过程、函数、触发器和视图的定义中可以包含分号，只能用GO结束
+_BATCH_ONLY_RE = re.compile(r'(create|alter|create\s+or\s+alter)\s+(proc|procedure|function|trigger|view)\b', re.I)
+_HEAD_SIZE = 64
+_CLOSE_QUOTE = {"'": "'", '"': '"', '`': '`', '[': ']'}
+
+
+class SqlSplitter:
+    """
+        流式拆分sql脚本，按块读取文件，逐条返回语句，字符串、带引号的标识符和注释中的分隔符不会拆分语句，
+        支持MySQL客户端的DELIMITER命令和SQL Server的GO批分隔符
+    """
+
+    def __init__(self, delimiter=';', backslash_escape=True, hash_comment=True, backtick_quote=True,
+                 bracket_quote=False, delimiter_command=True, go_separator=False, chunk_size=READ_CHUNK_SIZE):
+        self.__delimiter = delimiter
+        self.__backslash_escape = backslash_escape
+        self.__hash_comment = hash_comment
+        self.__backtick_quote = backtick_quote
+        self.__bracket_quote = bracket_quote
+        self.__delimiter_command = delimiter_command
+        self.__go_separator = go_separator
+        self.__chunk_size = chunk_size
+        self.__token_res = {}
+        self.__body_res = {}
+
+    def __token_re(self, delimiter):
+        if delimiter not in self.__token_res:
+            tokens = [re.escape(delimiter), "'", '"', '--', r'/\*', '\n']
+            tokens += ['`'] if self.__backtick_quote else []
+            tokens += [r'\['] if self.__bracket_quote else []
+            tokens += ['#'] if self.__hash_comment else []
+            self.__token_res[delimiter] = re.compile('|'.join(tokens))
+        return self.__token_res[delimiter]
+
+    def __body_re(self, delimiter):
+        """
+            一次匹配语句中连续的普通字符、完整的字符串和注释，直到分隔符或者需要逐个处理的位置，
+            不完整的字符串和注释不会被匹配，由逐个处理的逻辑读取更多内容后处理
+        """
+        if delimiter not in self.__body_res:
+            specials = {"'", '"', '/', '-', '\\', '\n', '`', '#', '['}
+            if len(delimiter) != 1 or delimiter in specials:
+                self.__body_res[delimiter] = None, None
+                return self.__body_res[delimiter]
+            excludes = ["'", '"', '/', '-', delimiter]
+            escape = r'\\.|' if self.__backslash_escape else ''
+            units = [f"'(?:[^'\\\\]|{escape}'')*'" if self.__backslash_escape else "'(?:[^']|'')*'",
+                     f'"(?:[^"\\\\]|{escape}"")*"' if self.__backslash_escape else '"(?:[^"]|"")*"',
+                     r'/\*(?:[^*]|\*(?!/))*\*/', r'--[^\n]*(?=\n)', r'/(?=[^*])', r'-(?=[^-])']
+            if self.__backtick_quote:
+                excludes.append('`')
+                units.append(r'`(?:[^`]|``)*`')
+            if self.__bracket_quote:
+                excludes.append('[')
+                units.append(r'\[(?:[^\]]|\]\])*\]')
+            if self.__hash_comment:
+                excludes.append('#')
+                units.append(r'#[^\n]*(?=\n)')
+            if self.__go_separator:
+                # 换行后面是GO时停下来，由逐行处理的逻辑结束批
+                excludes.append('\n')
+                units.append(r'\n(?=[^\n]*\n)(?![ \t]*[gG][oO](?:[ \t]+\d+)?[ \t]*\r?\n)')
+            plain = ''.join(re.escape(c) for c in excludes)
+            body = f"(?:[^{plain}]+|{'|'.join(units)})*"
+            # 语句前的空白，语句不能以注释、DELIMITER、GO和分隔符开始
+            comments = r'--|/\*|#' if self.__hash_comment else r'--|/\*'
+            lead = f'\\s*(?!\\s|{comments}|(?i:delimiter|go)\\b|{re.escape(delimiter)}|$)'
+            self.__body_res[delimiter] = re.compile(body), re.compile(lead)
+        return self.__body_res[delimiter]
+
+    def __quote_re(self, quote):
+        close = re.escape(_CLOSE_QUOTE[quote])
+        return re.compile(f'{close}|\\\\' if self.__backslash_escape and quote in {"'", '"'} else close)
+
+    def split(self, f):
+        """
+            f是文本文件对象，返回语句的生成器，语句不包含结尾的分隔符
+        """
+        quote_res = {q: self.__quote_re(q) for q in _CLOSE_QUOTE}
+        # buf[start:pos]是当前语句已经处理过的内容，更早的内容在parts中
+        state = {'buf': '', 'start': 0, 'pos': 0, 'eof': False}
+        parts, delimiter = [], self.__delimiter
+        has_code, batch_only, line_start = False, False, True
+
+        def fill():
+            # 当前位置之前的内容都属于当前语句，移到parts中，只在缓冲区中保留还没有处理的内容
+            chunk = f.read(self.__chunk_size)
+            if not chunk:
+                state['eof'] = True
+                return False
+            buf, start, pos = state['buf'], state['start'], state['pos']
+            if pos > start:
+                parts.append(buf[start:pos])
+            state['buf'], state['start'], state['pos'] = buf[pos:] + chunk, 0, 0
+            return True
+
+        def need(n):
+            # 保证当前位置之后至少有n个字符，文件结束时除外
+            while len(state['buf']) - state['pos'] < n and fill():
+                pass
+
+        def cut(stop, end):
+            # 返回当前语句(到stop为止)，下一条语句从end开始
+            statement = ''.join(parts) + state['buf'][state['start']:stop]
+            parts.clear()
+            state['start'] = state['pos'] = end
+            return statement.strip()
+
+        while True:
+            if line_start and (self.__go_separator or self.__delimiter_command and not has_code):
+                need(_HEAD_SIZE)
+                buf, pos = state['buf'], state['pos']
+                word = buf[pos:pos + _HEAD_SIZE].lstrip().lower()
+                if word.startswith('go') or word.startswith('delimiter'):
+                    nl = buf.find('\n', pos)
+                    while nl < 0 and fill():
+                        buf, pos = state['buf'], state['pos']
+                        nl = buf.find('\n', pos)
+                    line_end = len(buf) if nl < 0 else nl
+                    line = buf[pos:line_end]
+                    go_re = _GO_RE.match(line) if self.__go_separator else None
+                    delimiter_re = _DELIMITER_RE.match(line) if self.__delimiter_command and not has_code else None
+                    if go_re or delimiter_re:
+                        statement = cut(pos, line_end + 1)
+                        if go_re and has_code:
+                            yield statement
+                        if delimiter_re:
+                            delimiter = delimiter_re.group(1)
+                        has_code, batch_only = False, False
+                        if state['pos'] >= len(state['buf']) and not fill():
+                            break
+                        continue
+            buf, pos = state['buf'], state['pos']
+            body_re, lead_re = self.__body_re(delimiter)
+            if lead_re and not has_code and not parts and state['start'] == pos:
+                # 缓冲区中有完整的语句时整条匹配，不能整条匹配时逐个处理
+                lm = lead_re.match(buf, pos)
+                end = body_re.match(buf, lm.end()).end() if lm else -1
+                if 0 <= end < len(buf) and buf[end] == delimiter and \
+                        not (self.__go_separator and _BATCH_ONLY_RE.match(buf, lm.end(), lm.end() + _HEAD_SIZE)):
+                    state['start'] = state['pos'] = end + 1
+                    line_start = False
+                    yield buf[lm.end():end].strip()
+                    continue
+            line_start = False
+            if body_re and has_code:
+                state['pos'] = pos = body_re.match(buf, pos).end()
+            keep = max(len(delimiter), 3)
+            m = self.__token_re(delimiter).search(buf, pos)
+            if not state['eof'] and (m is None or m.end() + keep > len(buf)):
+                # 缓冲区末尾可能是不完整的分隔符或注释，读取更多内容后再处理，不能跳过已经找到的token的开头
+                safe = max(pos, len(buf) - keep) if m is None else m.start()
+                segment = buf[pos:safe]
+                if has_code or not segment.strip():
+                    state['pos'] = safe
+                    fill()
+                    continue
+                m = None
+            elif m is None:
+                if not has_code and buf[pos:].strip():
+                    has_code = True
+                break
+            else:
+                segment = buf[pos:m.start()]
+            if not has_code and (segment.strip() or m.group() in _CLOSE_QUOTE or
+                                 m.group() == '/*' and buf[m.end():m.end() + 1] in {'!', '+'}):
+                # 语句从第一个不是空白和注释的字符开始，前面的注释不作为语句的内容，/*!和/*+是可执行的注释
+                start = pos + len(segment) - len(segment.lstrip()) if segment.strip() else m.start()
+                parts.clear()
+                state['start'] = state['pos'] = start
+                need(_HEAD_SIZE)
+                has_code = True
+                head = state['buf'][state['start']:state['start'] + _HEAD_SIZE]
+                batch_only = self.__go_separator and _BATCH_ONLY_RE.match(head) is not None
+                continue
+            token = m.group()
+            if token == delimiter:
+                if batch_only:
+                    state['pos'] = m.end()
+                    continue
+                statement = cut(m.start(), m.end())
+                if has_code:
+                    yield statement
+                has_code = False
+            elif token == '\n':
+                state['pos'], line_start = m.end(), True
+            elif token in _CLOSE_QUOTE:
+                # 跳过字符串和带引号的标识符，连续两个引号或者反斜杠转义的引号不结束字符串
+                state['pos'] = m.end()
+                quote_re, close = quote_res[token], _CLOSE_QUOTE[token]
+                while True:
+                    buf, pos = state['buf'], state['pos']
+                    q = quote_re.search(buf, pos)
+                    if q is None:
+                        state['pos'] = len(buf)
+                        if not fill():
+                            break
+                        continue
+                    if q.end() >= len(buf) and not state['eof']:
+                        state['pos'] = q.start()
+                        fill()
+                        continue
+                    if q.group() != close or buf[q.end():q.end() + 1] == close:
+                        state['pos'] = q.end() + 1
+                    else:
+                        state['pos'] = q.end()
+                        break
+            elif token == '/*':
+                state['pos'] = m.end()
+                while True:
+                    buf, pos = state['buf'], state['pos']
+                    end = buf.find('*/', pos)
+                    if end >= 0:
+                        state['pos'] = end + 2
+                        break
+                    state['pos'] = max(pos, len(buf) - 1)
+                    if not fill():
+                        state['pos'] = len(state['buf'])
+                        break
+            else:
+                # --和#注释到行尾结束，换行符留给下一次处理
+                state['pos'] = m.end()
+                while True:
+                    buf, pos = state['buf'], state['pos']
+                    end = buf.find('\n', pos)
+                    if end >= 0:
+                        state['pos'] = end
+                        break
+                    state['pos'] = len(buf)
+                    if not fill():
+                        break
+        if has_code:
+            yield cut(len(state['buf']), len(state['buf']))
+
+
+def get_sql_splitter(server_type, chunk_size=READ_CHUNK_SIZE):
+    """
+        按数据库类型返回sql脚本的拆分器，MySQL支持反斜杠转义、#注释和DELIMITER，SQL Server支持[]标识符和GO
+    """
+    if server_type is DatabaseType.SQL_SERVER:
+        return SqlSplitter(backslash_escape=False, hash_comment=False, backtick_quote=False, bracket_quote=True,
+                           delimiter_command=False, go_separator=True, chunk_size=chunk_size)
+    return SqlSplitter(chunk_size=chunk_size)
+
+
+_INSERT_RE = re.compile(r'insert\s+into\s+[^\'"]+?\s+values\s*(?=\()', re.I)
+_VALUES_RES = {}
+
+
+def _values_re(server_type):
+    """
+        匹配INSERT语句的VALUES部分，只包含字面量的行，字符串后面不能紧跟引号，避免连续两个引号有多种匹配方式
+    """
+    if server_type not in _VALUES_RES:
+        if server_type is DatabaseType.SQL_SERVER:
+            # SQL Server的一条语句最多1000行，只合并单行的INSERT
+            values = f"\\((?:[^'\"()]|'(?:[^']|'')*'(?!'))*\\)"
+        else:
+            value = "\\((?:[^'\"()]|'(?:[^'\\\\]|\\\\.|'')*'(?!')|\"(?:[^\"\\\\]|\\\\.|\"\")*\"(?!\"))*\\)"
+            values = f'{value}(?:\\s*,\\s*{value})*'
+        _VALUES_RES[server_type] = re.compile(values)
+    return _VALUES_RES[server_type]
+
+
+def split_insert(sql, server_type):
+    """
+        把只包含字面量的INSERT ... VALUES语句拆分成(VALUES之前的部分, VALUES之后的行)，
+        表名和列相同的语句可以合并成一条多行INSERT，其他语句返回None
+    """
+    m = _INSERT_RE.match(sql)
+    if m is None or not _values_re(server_type).fullmatch(sql, m.end()):
+        return None
+    return sql[:m.end()], sql[m.end():]
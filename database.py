@@ -3,22 +3,55 @@ import re
 import sys
 
 from cmd.cmd import Cmd
+from cmd.daemon_cmd import forward_to_daemon
 from core import print_utils as pu
 
+# 输出缓冲区的大小(字节)
+OUTPUT_BUFFER_SIZE = 1024 * 1024
 PRINT_CONF = pu.PrintConf()
-PRINTER = pu.MsgPrinter()
-PRINT_FORMAT_SET = {'table', 'text', 'json', 'sql', 'html', 'html2', 'html3', 'html4', 'markdown', 'xml', 'csv'}
+PRINTER = pu.MsgPrinter(buffer_size=OUTPUT_BUFFER_SIZE)
+PRINT_FORMAT_SET = {'table', 'text', 'json', 'ndjson', 'jsonl', 'sql', 'html', 'html2', 'html3', 'html4', 'markdown',
+                    'xml', 'csv', 'tsv'}
+OUT_OPTION_SET = {'export', 'sql', 'scan', 'peek', 'desc', 'history', 'count', 'stats'}
 FOLD_LIMIT = 50
+# 流式打印表格时用来计算列宽的采样行数
+STREAM_SAMPLE_ROWS = 1000
+# 流式读取结果集时每批读取的行数
+FETCH_SIZE = 1000
+# 多行INSERT语句默认的最大字节数
+INSERT_MAX_BYTES = 1024 * 1024
+# 按主键分块导出时每个分块的行数
+EXPORT_CHUNK_SIZE = 10000
+# 导入sql文件时每执行多少条语句提交一次
+LOAD_COMMIT_SIZE = 1000
 params = {
     'printer': PRINTER,
     'print_conf': PRINT_CONF,
+    'color': True,
     'fold_limit': FOLD_LIMIT,
+    'stream_sample_rows': STREAM_SAMPLE_ROWS,
+    'fetch_size': FETCH_SIZE,
+    'stream': False,
+    'truncate': False,
+    'flatten': False,
     'fold': True,
     'human': False,
     'columns': None,
     'limit_rows': None,
     'export_type': 'all',
-    'out_format': 'table'
+    'out_format': 'table',
+    'out': None,
+    'csv_delimiter': ',',
+    'csv_quoting': 'minimal',
+    'insert_batch_rows': 1,
+    'insert_max_bytes': INSERT_MAX_BYTES,
+    'export_dir': None,
+    'workers': None,
+    'count_mode': None,
+    'export_chunk_size': EXPORT_CHUNK_SIZE,
+    'resume': False,
+    'import_file': None,
+    'load_commit_size': LOAD_COMMIT_SIZE
 }
 
 
@@ -27,6 +60,7 @@ def disable_color():
     PRINT_CONF.disable_color()
     PRINTER.disable_info_color()
     PRINTER.disable_warn_color()
+    params['color'] = False
 
 
 def error_param_exit(param):
@@ -44,19 +78,65 @@ def parse_columns(limit_column_re):
             else [i for i in range(int(t[0]), int(t[1]) - 1, -1)]
 
 
+def parse_delimiter(value):
+    value = {'tab': '\t', '\\t': '\t', 'comma': ',', 'pipe': '|', 'semicolon': ';'}.get(value.lower(), value)
+    if len(value) != 1:
+        raise ValueError(value)
+    return value
+
+
+def parse_positive_int(value):
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_chunk_size(value):
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_quoting(value):
+    if value.lower() not in pu.CSV_QUOTING:
+        raise ValueError(value)
+    return value.lower()
+
+
+# key=value形式的参数: key -> (参数名, 支持的操作, 值的解析函数)
+KV_PARAMS = {
+    'out': ('out', OUT_OPTION_SET, str),
+    'delimiter': ('csv_delimiter', OUT_OPTION_SET | {'import'}, parse_delimiter),
+    'quoting': ('csv_quoting', OUT_OPTION_SET, parse_quoting),
+    'batch': ('insert_batch_rows', OUT_OPTION_SET, parse_positive_int),
+    'dir': ('export_dir', {'export'}, str),
+    'workers': ('workers', {'export', 'load', 'count'}, parse_positive_int),
+    'chunk': ('export_chunk_size', {'export'}, parse_chunk_size),
+    'commit': ('load_commit_size', {'load'}, parse_chunk_size),
+}
+
+
 def parse_args(args):
-    set_format = set_human = set_export_type = set_columns = set_fold = set_raw = set_row_limit = set_show_obj = False
+    set_format = set_human = set_export_type = set_columns = set_fold = set_raw = set_row_limit = set_show_obj = \
+        set_stream = set_truncate = set_resume = set_flatten = set_count_mode = False
+    set_kv = set()
     option = args[1].strip().lower() if len(args) > 1 else 'info'
     option = {'hist': 'history'}.get(option, option)
-    params['option_val'], parse_start_pos = args[2] if len(args) > 2 else '', 3 if option == 'sql' else 2
+    params['option_val'], parse_start_pos = args[2] if len(args) > 2 else '', {'sql': 3, 'import': 4}.get(option, 2)
+    if option == 'import':
+        # 导入的表名和文件
+        params['import_file'] = args[3] if len(args) > 3 else ''
     if len(args) > parse_start_pos:
         for index in range(parse_start_pos, len(args)):
             p = args[index].strip().lower()
             limit_row_re = re.match("^(row)\[\s*(-?\d+)\s*:\s*(-?\d+)\s*(\])$", p)
             limit_column_re = re.match("^(col)\[((\s*\d+\s*-\s*\d+\s*)|(\s*(\d+)\s*(,\s*(\d+)\s*)*))(\])$", p)
+            # key=value形式的参数，value保留原始的大小写
+            kv_re = re.match("^(\w+)=(.+)$", args[index].strip())
             if option in {'info', 'shell', 'help', 'test', 'version'}:
                 error_param_exit(p)
-            elif index == 2 and option in {'sql', 'scan', 'peek', 'count', 'desc', 'load', 'set', 'lock', 'unlock'}:
+            elif index == 2 and option in {'sql', 'scan', 'peek', 'count', 'desc', 'load', 'set', 'lock', 'unlock',
+                                           'daemon'}:
                 continue  # 第3个参数可以自定义输入的操作
             elif option == 'show':
                 if p not in {'database', 'table', 'databases', 'tables', 'view', 'views'} or set_show_obj:
@@ -68,12 +148,14 @@ def parse_args(args):
                 set_row_limit, params['limit_rows'] = True, (int(limit_row_re.group(2)), int(limit_row_re.group(3)))
             elif not set_columns and option != 'export' and limit_column_re:
                 params['columns'], set_columns = parse_columns(limit_column_re), True
-            elif not set_format and option in {'export', 'sql', 'scan', 'peek', 'desc', 'history'} and \
-                    p in PRINT_FORMAT_SET:
+            elif not set_format and option in OUT_OPTION_SET and p in PRINT_FORMAT_SET:
                 if option != 'table':
                     disable_color()
                 else:
                     params['fold'] = False
+                if p in {'ndjson', 'jsonl'}:
+                    # 逐行JSON用于导出数据，不能折叠
+                    params['fold'] = False
                 params['out_format'], set_format = p, True
             elif not set_raw and params['out_format'] == 'table' and p == 'raw':
                 set_raw = True
@@ -82,6 +164,24 @@ def parse_args(args):
                 params['export_type'], set_export_type = p, True
             elif not set_human and p == 'human':
                 params['human'], set_human = True, True
+            elif not set_stream and option == 'sql' and p == 'stream':
+                params['stream'], set_stream = True, True
+            elif not set_truncate and option in {'scan', 'peek'} and p == 'truncate':
+                params['truncate'], set_truncate = True, True
+            elif not set_flatten and option in {'sql', 'scan', 'peek'} and p == 'flat':
+                params['flatten'], set_flatten = True, True
+            elif not set_count_mode and option == 'count' and p in {'estimate', 'exact'}:
+                params['count_mode'], set_count_mode = p, True
+            elif not set_resume and option == 'export' and p == 'resume':
+                params['resume'], set_resume = True, True
+            elif kv_re and kv_re.group(1).lower() in KV_PARAMS and kv_re.group(1).lower() not in set_kv and \
+                    option in KV_PARAMS[kv_re.group(1).lower()][1]:
+                param_name, _, parse_func = KV_PARAMS[kv_re.group(1).lower()]
+                try:
+                    params[param_name] = parse_func(kv_re.group(2))
+                except ValueError:
+                    error_param_exit(args[index])
+                set_kv.add(kv_re.group(1).lower())
             else:
                 error_param_exit(p)
     return option
@@ -93,7 +193,13 @@ if __name__ == '__main__':
     try:
         opt = parse_args(sys.argv)
         cmd = Cmd.get(opt)
+        exit_code = forward_to_daemon(opt, params) if cmd else None
+        if exit_code is not None:
+            PRINTER.close()
+            sys.exit(exit_code)
         if cmd:
+            if params['out']:
+                PRINTER.open_out(params['out'], params['resume'])
             cmd(opt=opt, **params).exe()
         else:
             print("Invalid Operation!")
@@ -102,3 +208,5 @@ if __name__ == '__main__':
         import traceback
 
         traceback.print_exc(chain=ex)
+    finally:
+        PRINTER.close()
@@ -0,0 +1,18 @@
+import unittest
+
+from cmd.import_cmd import get_import_format
+
+
+class ImportFormatTest(unittest.TestCase):
+
+    def test_extensions(self):
+        self.assertEqual(get_import_format('a.CSV'), 'csv')
+        self.assertEqual(get_import_format('a.tsv.gz'), 'tsv')
+        self.assertEqual(get_import_format('a.jsonl.xz'), 'ndjson')
+        # json文件按对象数组读取，不是每行一个对象
+        self.assertEqual(get_import_format('a.json'), 'json')
+        self.assertIsNone(get_import_format('a.sql'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from core.core import MySQLServer, SQLServer
+
+
+def new_server(cls):
+    # 只测试拼接sql，不需要数据库配置和连接
+    return cls.__new__(cls)
+
+
+class KeysetTest(unittest.TestCase):
+
+    def test_mysql(self):
+        server = new_server(MySQLServer)
+        self.assertEqual(server.get_keyset_sql('t', 'id', None, 10), 'SELECT * FROM `t` ORDER BY `id` LIMIT 10')
+        self.assertEqual(server.get_keyset_sql('t', 'id', server.key_literal("a'\\b"), 10),
+                         "SELECT * FROM `t` WHERE `id`>'a''\\\\b' ORDER BY `id` LIMIT 10")
+
+    def test_sql_server(self):
+        server = new_server(SQLServer)
+        self.assertEqual(server.get_keyset_sql('t', 'id', server.key_literal(5), 10),
+                         'SELECT TOP 10 * FROM [t] WHERE [id]>5 ORDER BY [id]')
+        self.assertEqual(server.key_literal("it's"), "N'it''s'")
+
+
+if __name__ == '__main__':
+    unittest.main()
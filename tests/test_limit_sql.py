@@ -0,0 +1,32 @@
+import unittest
+
+from core.core import MySQLServer, SQLServer
+
+
+def new_server(cls):
+    # 只测试拼接sql，不需要数据库配置和连接
+    return cls.__new__(cls)
+
+
+class LimitSqlTest(unittest.TestCase):
+
+    def test_mysql(self):
+        server = new_server(MySQLServer)
+        self.assertEqual(server.get_limit_sql('select * from t;', (5, 15)), 'select * from t LIMIT 5,10')
+        self.assertIsNone(server.get_limit_sql('select * from t limit 1', (0, 10)))
+
+    def test_sql_server_order_by(self):
+        server = new_server(SQLServer)
+        self.assertEqual(server.get_limit_sql('select a from t', (0, 10)), 'select TOP 10 a from t')
+        self.assertEqual(server.get_limit_sql('select a from t order by a', (5, 15)),
+                         'select a from t order by a OFFSET 5 ROWS FETCH NEXT 10 ROWS ONLY')
+        # 窗口函数和字符串中的ORDER BY不是最外层的排序
+        self.assertEqual(server.get_limit_sql('select row_number() over (order by a) rn from t', (5, 15)),
+                         'select row_number() over (order by a) rn from t ORDER BY (SELECT NULL) '
+                         'OFFSET 5 ROWS FETCH NEXT 10 ROWS ONLY')
+        self.assertEqual(server.get_limit_sql("select 'order by' a from t", (5, 15)),
+                         "select 'order by' a from t ORDER BY (SELECT NULL) OFFSET 5 ROWS FETCH NEXT 10 ROWS ONLY")
+
+
+if __name__ == '__main__':
+    unittest.main()
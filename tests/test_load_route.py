@@ -0,0 +1,28 @@
+import unittest
+
+from cmd.load_cmd import ROUTE_BARRIER, ROUTE_SESSION, ROUTE_SKIP, ROUTE_TABLE, get_load_route
+
+
+class LoadRouteTest(unittest.TestCase):
+
+    def test_table_statements(self):
+        for sql in ['INSERT INTO `a` VALUES (1)', 'CREATE TABLE `a`(id int)', 'DROP TABLE IF EXISTS `db`.`A`',
+                    'CREATE TABLE IF NOT EXISTS [dbo].[a] (x int)', 'TRUNCATE TABLE a',
+                    '/*!40000 ALTER TABLE `a` DISABLE KEYS */', 'SET IDENTITY_INSERT [dbo].[a] ON']:
+            self.assertEqual(get_load_route(sql), (ROUTE_TABLE, 'a'), sql)
+
+    def test_barrier_statements(self):
+        # 多表和引用其他表的DDL不能只在一个分区上执行
+        for sql in ['DROP TABLE a, b', 'ALTER TABLE a ADD CONSTRAINT f FOREIGN KEY (x) REFERENCES b (id)',
+                    'CREATE TABLE a (id int, b_id int, FOREIGN KEY (b_id) REFERENCES b(id))',
+                    'CREATE VIEW v AS SELECT 1']:
+            self.assertEqual(get_load_route(sql), (ROUTE_BARRIER, None), sql)
+
+    def test_session_statements(self):
+        self.assertEqual(get_load_route('USE db'), (ROUTE_SESSION, None))
+        self.assertEqual(get_load_route('/*!40101 SET NAMES utf8 */'), (ROUTE_SESSION, None))
+        self.assertEqual(get_load_route('LOCK TABLES `a` WRITE'), (ROUTE_SKIP, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from datetime import datetime, timezone
+
+from core.core import DbException
+from core.mongo_query import MongoQuery
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_find_with_cursor_methods(self):
+        q = MongoQuery.parse("db.users.find({age: {'$gt': 18}, active: true}, {'name': 1}).sort('name', -1).limit(5);")
+        self.assertEqual(q.collection, 'users')
+        self.assertEqual(q.method, 'find')
+        self.assertEqual(q.args, [{'age': {'$gt': 18}, 'active': True}, {'name': 1}])
+        self.assertEqual(q.modifiers, [('sort', ['name', -1], {}), ('limit', [5], {})])
+
+    def test_subscript_and_dotted_collection(self):
+        self.assertEqual(MongoQuery.parse("db['my-coll'].find()").collection, 'my-coll')
+        self.assertEqual(MongoQuery.parse('db.a.b.count_documents({})').collection, 'a.b')
+
+    def test_database_and_client_methods(self):
+        self.assertIsNone(MongoQuery.parse('db.list_collection_names()').collection)
+        self.assertEqual(MongoQuery.parse("db.command('collStats', 'x')").args, ['collStats', 'x'])
+
+    def test_display_methods_are_ignored(self):
+        self.assertEqual(MongoQuery.parse('db.t.find().pretty()').modifiers, [])
+
+    def test_literals(self):
+        q = MongoQuery.parse("db.t.find({'a': null, 'b': [1, -2.5, 'x'], 'c': ISODate('2024-01-02T03:04:05Z')})")
+        self.assertEqual(q.args[0], {'a': None, 'b': [1, -2.5, 'x'],
+                                     'c': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)})
+
+    def test_rejects_code(self):
+        for text in ("db.t.find(__import__('os').system('ls'))", 'db.t.find({a: b})', "print('x')",
+                     'db.t.find().explain()', 'db.t.rename("x")', 'db.t', 'db.t.find(', 'db.list_database()'):
+            with self.assertRaises(DbException, msg=text):
+                MongoQuery.parse(text)
+
+    def test_round_trip(self):
+        for text in ["db.t.find({'a': 1}).skip(2).limit(3)", "db['x-y'].aggregate([{'$match': {'a': True}}])",
+                     "db.t.find({'d': ISODate('2024-01-02T03:04:05+00:00')})", 'db.list_collection_names()']:
+            q = MongoQuery.parse(text)
+            self.assertEqual(str(MongoQuery.parse(str(q))), str(q))
+
+
+class LimitTest(unittest.TestCase):
+
+    def test_simple_select(self):
+        self.assertTrue(MongoQuery.parse('db.t.find().sort("a", 1)').is_simple_select())
+        self.assertTrue(MongoQuery.parse("db.t.aggregate([{'$match': {}}])").is_simple_select())
+        self.assertFalse(MongoQuery.parse('db.t.find().limit(1)').is_simple_select())
+        self.assertFalse(MongoQuery.parse("db.t.aggregate([{'$limit': 1}])").is_simple_select())
+        self.assertFalse(MongoQuery.parse("db.t.aggregate([{'$out': 'x'}])").is_simple_select())
+        self.assertFalse(MongoQuery.parse('db.t.count_documents({})').is_simple_select())
+
+    def test_find_with_limit(self):
+        q = MongoQuery.parse("db.t.find({'a': 1})")
+        self.assertEqual(str(q.with_limit(0, 10)), "db.t.find({'a': 1}).limit(10)")
+        self.assertEqual(str(q.with_limit(5, 10)), "db.t.find({'a': 1}).skip(5).limit(10)")
+        self.assertEqual(q.modifiers, [])
+
+    def test_aggregate_with_limit(self):
+        q = MongoQuery.parse("db.t.aggregate([{'$match': {}}], {'allowDiskUse': True})")
+        limited = q.with_limit(5, 10)
+        self.assertEqual(limited.pipeline, [{'$match': {}}, {'$skip': 5}, {'$limit': 10}])
+        self.assertEqual(limited.args[1], {'allowDiskUse': True})
+        self.assertEqual(q.pipeline, [{'$match': {}}])
+
+
+class Recorder:
+    """
+        记录调用的方法和参数，代替pymongo的客户端、数据库、集合和游标
+    """
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getitem__(self, name):
+        return self
+
+    def __getattr__(self, name):
+        def _call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return _call
+
+
+class ExecuteTest(unittest.TestCase):
+
+    def execute(self, text, batch_size=None):
+        calls = []
+        MongoQuery.parse(text).execute(Recorder(calls), 'db', batch_size)
+        return calls
+
+    def test_find_modifiers(self):
+        self.assertEqual(self.execute("db.t.find({'a': 1}).sort('a', -1).limit(2)", 100),
+                         [('find', ({'a': 1},), {}), ('sort', ('a', -1), {}), ('limit', (2,), {}),
+                          ('batch_size', (100,), {})])
+
+    def test_aggregate_options(self):
+        self.assertEqual(self.execute("db.t.aggregate([{'$match': {}}], {allowDiskUse: true})", 100),
+                         [('aggregate', ([{'$match': {}}],), {'allowDiskUse': True, 'batchSize': 100})])
+
+    def test_count(self):
+        self.assertEqual(self.execute("db.t.count({'a': 1})"), [('count_documents', ({'a': 1},), {})])
+        self.assertEqual(self.execute('db.t.find().count()'), [('find', (), {}), ('count_documents', ({},), {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
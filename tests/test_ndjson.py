@@ -0,0 +1,19 @@
+import io
+import unittest
+from decimal import Decimal
+
+import core.print_utils as pu
+
+
+class NdjsonTest(unittest.TestCase):
+
+    def test_types(self):
+        out = io.StringIO()
+        mp = pu.MsgPrinter(normal_out=out)
+        pu.print_ndjson(['a', 'b', 'c', 'd'], [[float('nan'), [1.5, float('inf')], Decimal('1.10'), None]], mp)
+        mp.flush()
+        self.assertEqual(out.getvalue(), '{"a":null,"b":[1.5,null],"c":1.10,"d":null}\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
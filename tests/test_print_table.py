@@ -0,0 +1,67 @@
+import io
+import unittest
+
+import core.print_utils as pu
+
+
+def new_conf():
+    pc = pu.PrintConf()
+    pc.disable_color()
+    return pc
+
+
+def render_stream(header, rows, **kwargs):
+    out = io.StringIO()
+    mp = pu.MsgPrinter(normal_out=out, msg_out=io.StringIO())
+    pu.print_table_stream(header, rows, new_conf(), mp, **kwargs)
+    mp.flush()
+    return out.getvalue().splitlines()
+
+
+class FitWidthTest(unittest.TestCase):
+
+    def test_fold_marker(self):
+        pc = new_conf()
+        self.assertEqual(pu._fit_width('abc', 5, pc), ('abc', 3))
+        self.assertEqual(pu._fit_width('abcdefgh', 5, pc), ('ab...', 5))
+        # 宽字符不能只保留半个
+        self.assertEqual(pu._fit_width('中文中文', 6, pc), ('中...', 5))
+
+    def test_narrower_than_fold_marker(self):
+        # 列宽小于省略符时直接截断，不能输出空字符串
+        pc = new_conf()
+        self.assertEqual(pu._fit_width('333', 2, pc), ('33', 2))
+        self.assertEqual(pu._fit_width('abcdef', 1, pc), ('a', 1))
+        self.assertEqual(pu._fit_width(pc.null_str_with_color, 2, pc), ('NU', 2))
+
+    def test_already_folded(self):
+        pc = new_conf()
+        self.assertEqual(pu._fit_width(f'abcdef{pc.fold_replace_str_with_color}', 6, pc), ('abc...', 6))
+
+
+class PrintTableStreamTest(unittest.TestCase):
+
+    def test_same_as_print_table(self):
+        header, rows = ['id', 'name'], [[1, 'a'], [22, None], [3, '中文']]
+        out = io.StringIO()
+        mp = pu.MsgPrinter(normal_out=out, msg_out=io.StringIO())
+        pu.print_table(list(header), [list(r) for r in rows], new_conf(), mp)
+        mp.flush()
+        self.assertEqual(render_stream(header, iter(rows)), out.getvalue().splitlines())
+
+    def test_rows_after_sample(self):
+        lines = render_stream(['id', 'name'], iter([[1, 'a'], [333, 'bbbbbbbb'], [None, 'c']]), sample_size=1)
+        self.assertEqual(lines[3:6], ['|  1 | a    | ', '| 33 | b... | ', '| NU | c    | '])
+        # 每一行的宽度都和表头一致
+        self.assertEqual({len(line) for line in lines}, {len(lines[0])})
+
+    def test_max_col_width(self):
+        lines = render_stream(['id', 'name'], [[1, 'abcdefgh']], max_col_width=5)
+        self.assertEqual(lines[3], '|  1 | ab... | ')
+
+    def test_empty(self):
+        self.assertEqual(render_stream(['id', 'name'], iter([])), ['+ -- + ---- + ', '| id | name | ', '+ -- + ---- + '])
+
+
+if __name__ == '__main__':
+    unittest.main()
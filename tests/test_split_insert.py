@@ -0,0 +1,25 @@
+import unittest
+
+from core.core import DatabaseType
+from core.sql_splitter import split_insert
+
+
+class SplitInsertTest(unittest.TestCase):
+
+    def test_literal_rows(self):
+        self.assertEqual(split_insert("INSERT INTO `t` (`a`,`b`) VALUES (1,'x''y'),(2,'a\\'b')", DatabaseType.MYSQL),
+                         ('INSERT INTO `t` (`a`,`b`) VALUES ', "(1,'x''y'),(2,'a\\'b')"))
+
+    def test_not_literal(self):
+        for sql in ['INSERT INTO t VALUES (now())', 'INSERT INTO t SELECT * FROM s',
+                    "INSERT INTO t VALUES (1); DROP TABLE t", 'UPDATE t SET a=1']:
+            self.assertIsNone(split_insert(sql, DatabaseType.MYSQL), sql)
+
+    def test_sql_server_single_row(self):
+        self.assertEqual(split_insert("INSERT INTO [t] VALUES (1,N'x''y')", DatabaseType.SQL_SERVER),
+                         ('INSERT INTO [t] VALUES ', "(1,N'x''y')"))
+        self.assertIsNone(split_insert("INSERT INTO [t] VALUES (1),(2)", DatabaseType.SQL_SERVER))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import io
+import unittest
+
+from core.core import DatabaseType
+from core.sql_splitter import READ_CHUNK_SIZE, get_sql_splitter
+
+
+def split(text, server_type=DatabaseType.MYSQL, chunk_size=READ_CHUNK_SIZE):
+    return list(get_sql_splitter(server_type, chunk_size).split(io.StringIO(text)))
+
+
+class MySQLSplitTest(unittest.TestCase):
+
+    def test_quotes_and_comments(self):
+        text = "select 'a;b', \"c;\\\"d\", `e;f`; -- x;\n# y;\n/* z; */ select 2;"
+        self.assertEqual(split(text), ["select 'a;b', \"c;\\\"d\", `e;f`", 'select 2'])
+
+    def test_delimiter_command(self):
+        text = 'DELIMITER $$\nCREATE PROCEDURE p() BEGIN SELECT 1; END$$\nDELIMITER ;\nselect 2;\n'
+        self.assertEqual(split(text), ['CREATE PROCEDURE p() BEGIN SELECT 1; END', 'select 2'])
+
+    def test_executable_comment(self):
+        self.assertEqual(split('/*!40101 SET NAMES utf8 */;\nselect 1'), ['/*!40101 SET NAMES utf8 */', 'select 1'])
+
+
+class SQLServerSplitTest(unittest.TestCase):
+
+    def test_go_separator(self):
+        self.assertEqual(split('select 1\nGO\nselect [a;b]\ngo 2\n', DatabaseType.SQL_SERVER),
+                         ['select 1', 'select [a;b]'])
+
+    def test_batch_only_statement_after_go(self):
+        text = 'select 1;\nGO\nCREATE PROCEDURE p AS BEGIN SELECT 1; SELECT 2; END\nGO\n'
+        self.assertEqual(split(text, DatabaseType.SQL_SERVER),
+                         ['select 1', 'CREATE PROCEDURE p AS BEGIN SELECT 1; SELECT 2; END'])
+
+    def test_batch_only_statement_at_start(self):
+        text = 'CREATE VIEW v AS SELECT 1 a; \nGO\nselect 2;'
+        self.assertEqual(split(text, DatabaseType.SQL_SERVER), ['CREATE VIEW v AS SELECT 1 a;', 'select 2'])
+
+
+class ChunkBoundaryTest(unittest.TestCase):
+    """
+        按块读取时语句的拆分结果不能受块大小影响
+    """
+
+    def assert_chunk_invariant(self, text, server_type=DatabaseType.MYSQL):
+        expected = split(text, server_type)
+        for chunk_size in range(1, 12):
+            self.assertEqual(split(text, server_type, chunk_size), expected, f'chunk_size={chunk_size}')
+
+    def test_mysql(self):
+        self.assert_chunk_invariant("select 1;/* c; */select 'it''s;' -- c;\n, `a;b`;\n"
+                                    "DELIMITER $$\nselect 2; select 3$$\nDELIMITER ;\n# h;\nselect 4")
+
+    def test_comment_at_chunk_end(self):
+        self.assert_chunk_invariant("select 1/* c; */;insert into t values (1)/* a; */'x;y'")
+
+    def test_sql_server(self):
+        self.assert_chunk_invariant("select 1;\nGO\nCREATE PROCEDURE p AS BEGIN SELECT 'a;'; SELECT [b;]; END\n"
+                                    "GO\n-- c;\nselect 2; /* d; */ select 3\ngo\n", DatabaseType.SQL_SERVER)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+import core.print_utils as pu
+
+
+class TextWidthTest(unittest.TestCase):
+
+    def test_ascii_matches_char_width(self):
+        for c in map(chr, range(128)):
+            self.assertEqual(pu._text_width(c), pu._calc_char_width(c), repr(c))
+
+    def test_wide_chars(self):
+        self.assertEqual(pu._text_width('ab中文'), 6)
+        self.assertEqual(pu._text_width('a\x0eb'), 2)
+
+    def test_long_text_not_cached(self):
+        pu._cached_text_width.cache_clear()
+        text = '中' * (pu.WIDTH_CACHE_TEXT_LEN + 1)
+        self.assertEqual(pu._text_width(text), 2 * len(text))
+        self.assertEqual(pu._cached_text_width.cache_info().currsize, 0)
+        self.assertEqual(pu._text_width('中文'), 4)
+        self.assertEqual(pu._cached_text_width.cache_info().currsize, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()